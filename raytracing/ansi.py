@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""Delta-encoded ANSI output for the terminal demos.
+
+Writing a `\\033[48;2;r;g;bm ` escape for every cell of every frame costs about
+20 bytes per cell, i.e. hundreds of KB per frame on a big terminal, and the
+terminal quickly becomes the bottleneck. FrameEncoder remembers the last frame
+which was sent to the terminal and emits only what is needed to update it:
+
+  - rows and cells which didn't change are skipped with a cursor jump;
+
+  - the color escape is emitted only when it differs from the one of the
+    previous cell, so a run of cells of the same color costs one byte each;
+
+  - the escape strings are cached per color. With color_bits < 8 the colors
+    are quantized first, which bounds the cache and makes the runs longer.
+
+Terminal cells are about twice as tall as they are wide. In half-block mode
+each cell shows two pixels stacked vertically: the upper half block `▀` is
+drawn with the color of the top pixel as foreground and the color of the
+bottom pixel as background. This doubles the vertical resolution, and since
+most cells only need one of the two colors to change, the output grows much
+less than the number of pixels.
+"""
+
+# two runs of changed cells which are separated by at most this many unchanged
+# cells are merged: rewriting the cells is cheaper than a cursor jump
+MAX_GAP = 3
+
+# don't let the cache of escapes grow without bounds with 24-bit colors
+MAX_CACHED_COLORS = 65536
+
+HALF_BLOCK = '\u2580'
+
+
+def output_size(text: str) -> int:
+    """Number of bytes which `text` takes once written to the terminal"""
+    # everything is ASCII, apart from the half blocks which are 3 bytes in UTF-8
+    return len(text) + 2 * text.count(HALF_BLOCK)
+
+
+def half_block_cells(pixels: bytes, width: int, height: int) -> bytes:
+    """
+    Pair up the rows of a RGB24 framebuffer: return (height + 1) // 2 rows of
+    cells, each made of 6 bytes (RGB of the top pixel, RGB of the bottom
+    pixel). If height is odd, the bottom half of the last row is black.
+    """
+    row_size = width * 3
+    rows = (height + 1) // 2
+    pixels = bytes(pixels[:width * height * 3]).ljust(rows * 2 * row_size, b'\0')
+    tops = b''.join([pixels[y * row_size:(y + 1) * row_size]
+                     for y in range(0, rows * 2, 2)])
+    bottoms = b''.join([pixels[y * row_size:(y + 1) * row_size]
+                        for y in range(1, rows * 2, 2)])
+    cells = bytearray(rows * width * 6)
+    for c in range(3):
+        cells[c::6] = tops[c::3]
+        cells[c + 3::6] = bottoms[c::3]
+    return bytes(cells)
+
+
+def rgb_to_half_blocks(pixels: bytes, width: int, height: int) -> str:
+    """
+    Turn a RGB24 framebuffer into ANSI escape codes, two pixels per cell: it
+    takes (height + 1) // 2 lines of the terminal
+    """
+    cells = half_block_cells(pixels, width, height)
+    row_size = width * 6
+    buffer = []
+    for start in range(0, len(cells), row_size):
+        row = cells[start:start + row_size]
+        line = [f'\033[48;2;{row[i]};{row[i+1]};{row[i+2]}m '
+                if row[i:i + 3] == row[i + 3:i + 6] else
+                f'\033[38;2;{row[i]};{row[i+1]};{row[i+2]};'
+                f'48;2;{row[i+3]};{row[i+4]};{row[i+5]}m{HALF_BLOCK}'
+                for i in range(0, row_size, 6)]
+        line.append('\033[0m\n')
+        buffer.append(''.join(line))
+    return ''.join(buffer)
+
+
+def changed_runs(row: bytes, old: bytes, width: int, cell_size: int = 3) -> list:
+    """
+    List of [x0, x1) ranges of the cells which differ between two rows of
+    cells of cell_size bytes each (3 for RGB24)
+    """
+    runs = []
+    x = 0
+    while x < width:
+        i = x * cell_size
+        if row[i:i + cell_size] == old[i:i + cell_size]:
+            x += 1
+            continue
+        # x is the first changed cell: find the end of the run
+        x0 = x
+        x1 = x + 1
+        x = x1
+        while x < width:
+            i = x * cell_size
+            if row[i:i + cell_size] != old[i:i + cell_size]:
+                x1 = x = x + 1
+            elif x - x1 >= MAX_GAP:
+                break
+            else:
+                x += 1
+        runs.append((x0, x1))
+    return runs
+
+
+class FrameEncoder:
+    """
+    Turn RGB24 framebuffers into the ANSI escapes which update the terminal
+    from the previous frame to the new one.
+
+    The first frame, and every frame after a change of size or a call to
+    reset(), is drawn in full. After each call to encode(), `cells` contains
+    the number of cells which were written.
+
+    With half_blocks=True, each cell of the terminal shows two rows of
+    pixels, so a frame of width x height pixels takes (height + 1) // 2 lines.
+    """
+
+    def __init__(self, color_bits: int = 8, half_blocks: bool = False):
+        self.color_bits = color_bits
+        self.half_blocks = half_blocks
+        if color_bits < 8:
+            mask = (0xff << (8 - color_bits)) & 0xff
+            self.quantize = bytes(v & mask for v in range(256))
+        else:
+            self.quantize = None
+        self.escapes = {}   # RGB triple -> SGR escape
+        self.fg_escapes = {}  # same, for the foreground color of half blocks
+        self.prev = None    # the frame currently on the terminal
+        self.size = None
+        self.cells = 0
+
+    def reset(self) -> None:
+        """Forget the previous frame, e.g. after the screen has been cleared"""
+        self.prev = None
+
+    def _escape(self, color: bytes) -> str:
+        esc = self.escapes.get(color)
+        if esc is None:
+            if len(self.escapes) >= MAX_CACHED_COLORS:
+                self.escapes.clear()
+            esc = f'\033[48;2;{color[0]};{color[1]};{color[2]}m'
+            self.escapes[color] = esc
+        return esc
+
+    def _fg_escape(self, color: bytes) -> str:
+        esc = self.fg_escapes.get(color)
+        if esc is None:
+            if len(self.fg_escapes) >= MAX_CACHED_COLORS:
+                self.fg_escapes.clear()
+            esc = f'\033[38;2;{color[0]};{color[1]};{color[2]}m'
+            self.fg_escapes[color] = esc
+        return esc
+
+    def encode(self, pixels: bytes, width: int, height: int) -> str:
+        """Return the escapes to draw `pixels`, a RGB24 framebuffer"""
+        frame = bytes(pixels)
+        if self.quantize is not None:
+            frame = frame.translate(self.quantize)
+        if self.half_blocks:
+            return self._encode_half_blocks(frame, width, height)
+        prev = self.prev
+        if self.size != (width, height):
+            prev = None
+
+        out = []
+        row_size = width * 3
+        current = None   # the background color selected on the terminal
+        cells = 0
+        for y in range(height):
+            start = y * row_size
+            row = frame[start:start + row_size]
+            if prev is None:
+                runs = [(0, width)]
+            else:
+                old = prev[start:start + row_size]
+                if row == old:
+                    continue
+                runs = changed_runs(row, old, width)
+
+            for x0, x1 in runs:
+                out.append(f'\033[{y + 1};{x0 + 1}H')
+                n = 0   # cells of the current color which are not written yet
+                for i in range(x0 * 3, x1 * 3, 3):
+                    color = row[i:i + 3]
+                    if color != current:
+                        if n:
+                            out.append(' ' * n)
+                            n = 0
+                        out.append(self._escape(color))
+                        current = color
+                    n += 1
+                out.append(' ' * n)
+                cells += x1 - x0
+
+        if out:
+            out.append('\033[0m')
+        self.prev = frame
+        self.size = (width, height)
+        self.cells = cells
+        return ''.join(out)
+
+    def _encode_half_blocks(self, frame: bytes, width: int, height: int) -> str:
+        cells = half_block_cells(frame, width, height)
+        prev = self.prev
+        if self.size != (width, height):
+            prev = None
+
+        out = []
+        row_size = width * 6
+        fg = None   # the colors selected on the terminal
+        bg = None
+        written = 0
+        for y in range(len(cells) // row_size):
+            start = y * row_size
+            row = cells[start:start + row_size]
+            if prev is None:
+                runs = [(0, width)]
+            else:
+                old = prev[start:start + row_size]
+                if row == old:
+                    continue
+                runs = changed_runs(row, old, width, 6)
+
+            for x0, x1 in runs:
+                out.append(f'\033[{y + 1};{x0 + 1}H')
+                text = []   # characters which are not written yet
+                for i in range(x0 * 6, x1 * 6, 6):
+                    top = row[i:i + 3]
+                    bottom = row[i + 3:i + 6]
+                    # both pixels of the same color: a space only needs the
+                    # background, whatever the foreground is
+                    char = ' ' if top == bottom else HALF_BLOCK
+                    if bottom != bg or (char != ' ' and top != fg):
+                        if text:
+                            out.append(''.join(text))
+                            text = []
+                        if bottom != bg:
+                            out.append(self._escape(bottom))
+                            bg = bottom
+                        if char != ' ' and top != fg:
+                            out.append(self._fg_escape(top))
+                            fg = top
+                    text.append(char)
+                out.append(''.join(text))
+                written += x1 - x0
+
+        if out:
+            out.append('\033[0m')
+        self.prev = cells
+        self.size = (width, height)
+        self.cells = written
+        return ''.join(out)
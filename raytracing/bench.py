@@ -1,10 +1,33 @@
 #!/usr/bin/env python3
 """Benchmark for the raytracer rendering engine"""
 
+import os
+import random
 import time
-from raytracer import Vec3, Ray, Sphere, Plane, trace_ray
+from raytracer import Vec3, Ray, Sphere, Plane, Camera, BVH, trace_ray, occluded
 
-def render_frame(width: int, height: int, ball_pos: Vec3) -> None:
+# 'python': trace one pixel at a time with raytracer.trace_ray
+# 'numpy': trace the whole frame at once with raytracer_np (needs numpy)
+# 'parallel': trace bands of rows on a process pool with raytracer_mp, and
+#             report the speedup for each number of workers
+# 'spy': render with the compiled raytracer.spy (build it with ./build-cffi.sh)
+BACKEND = 'python'
+
+# if True, render all the frames of the benchmark with a single call, which
+# sets up the scene and the primary rays only once (numpy and spy backends)
+BATCH = False
+
+# if True, compare the linear scan and the BVH on scenes with an increasing
+# number of spheres, instead of running the normal benchmark
+SCENE_SWEEP = False
+SCENE_SIZES = [10, 100, 1000, 10000]
+
+# if True, compare the cost of the shadow rays (any-hit query) with the cost
+# of the primary rays (closest-hit search), instead of running the normal
+# benchmark
+SHADOW_BENCH = False
+
+def render_frame(width: int, height: int, ball_pos: Vec3, camera: Camera) -> None:
     """Render a single frame (no output)"""
     # Scene setup
     objects = [
@@ -14,31 +37,260 @@ def render_frame(width: int, height: int, ball_pos: Vec3) -> None:
     ]
 
     light_dir = Vec3(0.5, 1, 0.3).normalize()
-    camera_pos = Vec3(0, 0, 0)
 
-    aspect_ratio = width / height
-    fov = 3.14159265359 / 3
+    # Ray directions are cached by the camera across frames
+    trace_frame(width, height, objects, light_dir, camera)
+
+
+def render_frame_numpy(width: int, height: int, ball_pos: Vec3, camera: Camera) -> None:
+    """Render a single frame with raytracer_np (no output)"""
+    from raytracer_np import render_np
+    objects = [
+        Sphere(ball_pos, 0.8, (1.0, 0.3, 0.3)),
+        Sphere(Vec3(2.5, -0.3, -6), 1.0, (0.3, 0.3, 1.0)),
+        Plane(Vec3(0, -1.5, 0), Vec3(0, 1, 0), (0.7, 0.7, 0.7))
+    ]
+    light_dir = Vec3(0.5, 1, 0.3).normalize()
+    render_np(width, height, objects, light_dir, camera)
+
+
+def render_frame_spy(width: int, height: int, ball_pos: Vec3, camera: Camera) -> None:
+    """Render a single frame with the compiled raytracer.spy (no output)"""
+    from raytracer_spy import render_rgb
+    render_rgb(width, height, ball_pos, camera)
+
+
+def render_batch(width: int, height: int, ball_positions: list, camera: Camera) -> None:
+    """Render one frame per ball position with a single call (no output)"""
+    if BACKEND == 'spy':
+        from raytracer_spy import render_rgb_batch
+        render_rgb_batch(width, height, ball_positions, camera)
+    elif BACKEND == 'numpy':
+        from raytracer_np import render_np_batch
+        light_dir = Vec3(0.5, 1, 0.3).normalize()
+        scenes = [[
+            Sphere(ball_pos, 0.8, (1.0, 0.3, 0.3)),
+            Sphere(Vec3(2.5, -0.3, -6), 1.0, (0.3, 0.3, 1.0)),
+            Plane(Vec3(0, -1.5, 0), Vec3(0, 1, 0), (0.7, 0.7, 0.7))
+        ] for ball_pos in ball_positions]
+        render_np_batch(width, height, scenes, light_dir, camera)
+    else:
+        raise ValueError(f'BATCH is not supported by the {BACKEND!r} backend')
+
+
+def trace_frame(width: int, height: int, objects, light_dir: Vec3, camera: Camera) -> None:
+    dirs = camera.directions(width, height)
+    for i in range(0, width * height * 3, 3):
+        direction = Vec3(dirs[i], dirs[i + 1], dirs[i + 2])
+        ray = Ray(camera.pos, direction)
+
+        # Trace ray
+        trace_ray(ray, objects, light_dir)
+
+
+def benchmark_parallel():
+    """Measure how raytracer_mp scales with the number of workers"""
+    from raytracer_mp import ParallelRenderer, render_rows
+    width = 80
+    height = 30
+    num_frames = 20
+    light_dir = Vec3(0.5, 1, 0.3).normalize()
+    camera = Camera(Vec3(0, 0, 0), 3.14159265359 / 3)
+
+    def make_objects(i):
+        return [
+            Sphere(Vec3(-2.0 + i * 0.05, 0.0, -4.0), 0.8, (1.0, 0.3, 0.3)),
+            Sphere(Vec3(2.5, -0.3, -6), 1.0, (0.3, 0.3, 1.0)),
+            Plane(Vec3(0, -1.5, 0), Vec3(0, 1, 0), (0.7, 0.7, 0.7))
+        ]
 
-    for y in range(height):
-        for x in range(width):
-            # Calculate ray direction
-            px = (2 * (x + 0.5) / width - 1) * aspect_ratio * (fov / 2) ** 0.5
-            py = (1 - 2 * (y + 0.5) / height) * (fov / 2) ** 0.5
+    print(f"Benchmarking parallel raytracer...")
+    print(f"Resolution: {width}x{height}")
+    print(f"Frames: {num_frames}")
+    print(f"CPUs: {os.cpu_count()}")
+    print()
+
+    # Serial baseline: same code as the workers, in this process
+    start_time = time.time()
+    for i in range(num_frames):
+        render_rows(width, height, 0, height, make_objects(i), light_dir, camera)
+    serial_fps = num_frames / (time.time() - start_time)
 
-            direction = Vec3(px, py, -1).normalize()
-            ray = Ray(camera_pos, direction)
+    worker_counts = [n for n in (1, 2, 4, 8, 16) if n < os.cpu_count()]
+    worker_counts.append(os.cpu_count())
 
-            # Trace ray
-            trace_ray(ray, objects, light_dir)
+    print("=" * 50)
+    print(f"{'workers':>8} {'FPS':>10} {'speedup':>10} {'efficiency':>12}")
+    print("=" * 50)
+    print(f"{'serial':>8} {serial_fps:>10.2f} {1.0:>9.2f}x {'':>12}")
+    for workers in worker_counts:
+        with ParallelRenderer(workers) as renderer:
+            # Warm up: attach the workers to the framebuffer
+            renderer.render(width, height, make_objects(0), light_dir, camera)
+            start_time = time.time()
+            for i in range(num_frames):
+                renderer.render(width, height, make_objects(i), light_dir, camera)
+            fps = num_frames / (time.time() - start_time)
+        speedup = fps / serial_fps
+        print(f"{workers:>8} {fps:>10.2f} {speedup:>9.2f}x {speedup / workers:>11.0%}")
+    print("=" * 50)
+
+
+def make_random_scene(num_spheres: int, seed: int = 42) -> list:
+    """
+    Ground plane plus num_spheres random spheres in front of the camera. The
+    radius shrinks as the number of spheres grows, so that the fraction of
+    the volume covered by spheres stays roughly the same.
+    """
+    rng = random.Random(seed)
+    radius = 1.5 / num_spheres ** (1 / 3)
+    objects = [Plane(Vec3(0, -1.5, 0), Vec3(0, 1, 0), (0.7, 0.7, 0.7))]
+    for i in range(num_spheres):
+        center = Vec3(rng.uniform(-8, 8), rng.uniform(-1.5, 4), rng.uniform(-20, -4))
+        color = (rng.random(), rng.random(), rng.random())
+        objects.append(Sphere(center, radius * rng.uniform(0.5, 1.5), color))
+    return objects
+
+
+def benchmark_scene_sizes():
+    """Cost per ray of the linear scan vs the BVH, for growing scenes"""
+    width = 32
+    height = 12
+    num_frames = 3
+    light_dir = Vec3(0.5, 1, 0.3).normalize()
+    camera = Camera(Vec3(0, 0, 0), 3.14159265359 / 3)
+    total_rays = width * height * num_frames
+
+    print(f"Benchmarking scene sizes...")
+    print(f"Resolution: {width}x{height}")
+    print(f"Frames: {num_frames}")
+    print()
+    print("=" * 66)
+    print(f"{'spheres':>8} {'linear µs/ray':>14} {'BVH µs/ray':>12} {'speedup':>9}"
+          f" {'build ms':>9} {'refit ms':>9}")
+    print("=" * 66)
+    for num_spheres in SCENE_SIZES:
+        objects = make_random_scene(num_spheres)
+
+        start_time = time.time()
+        bvh = BVH(objects)
+        build_time = time.time() - start_time
+
+        start_time = time.time()
+        for i in range(num_frames):
+            trace_frame(width, height, objects, light_dir, camera)
+        linear_time = time.time() - start_time
+
+        # Move one sphere per frame, like the bouncing ball in demo.py
+        ball = objects[1]
+        refit_time = 0.0
+        start_time = time.time()
+        for i in range(num_frames):
+            ball.center = Vec3(ball.center.x + 0.05, ball.center.y, ball.center.z)
+            t0 = time.time()
+            bvh.refit()
+            refit_time += time.time() - t0
+            trace_frame(width, height, bvh, light_dir, camera)
+        bvh_time = time.time() - start_time
+
+        print(f"{num_spheres:>8} {linear_time / total_rays * 1e6:>14.2f}"
+              f" {bvh_time / total_rays * 1e6:>12.2f}"
+              f" {linear_time / bvh_time:>8.1f}x"
+              f" {build_time * 1000:>9.1f} {refit_time / num_frames * 1000:>9.2f}")
+    print("=" * 66)
+
+
+def closest_hit(ray: Ray, objects):
+    """The closest-hit search of trace_ray, without the shading"""
+    closest = None
+    for obj in objects:
+        hit = obj.intersect(ray)
+        if hit and (closest is None or hit.t < closest.t):
+            closest = hit
+    return closest
+
+
+def benchmark_shadows():
+    """Cost per ray of the any-hit shadow query vs the closest-hit search"""
+    width = 80
+    height = 30
+    num_frames = 3
+    light_dir = Vec3(0.5, 1, 0.3).normalize()
+    camera = Camera(Vec3(0, 0, 0), 3.14159265359 / 3)
+    scenes = [
+        ('demo', [
+            Sphere(Vec3(-1.0, -0.7, -4.0), 0.8, (1.0, 0.3, 0.3)),
+            Sphere(Vec3(2.5, -0.3, -6), 1.0, (0.3, 0.3, 1.0)),
+            Plane(Vec3(0, -1.5, 0), Vec3(0, 1, 0), (0.7, 0.7, 0.7))
+        ]),
+        ('100 spheres', make_random_scene(100)),
+    ]
+
+    print(f"Benchmarking shadow rays...")
+    print(f"Resolution: {width}x{height}")
+    print(f"Frames: {num_frames}")
+    print()
+    print("=" * 72)
+    print(f"{'scene':>12} {'primary':>9} {'shadow rays':>12} {'closest-hit':>12}"
+          f" {'any-hit':>9} {'speedup':>8} {'shadowed':>9}")
+    print(f"{'':>12} {'µs/ray':>9} {'per frame':>12} {'µs/ray':>12} {'µs/ray':>9}")
+    print("=" * 72)
+    dirs = camera.directions(width, height)
+    for name, objects in scenes:
+        rays = [Ray(camera.pos, Vec3(dirs[i], dirs[i + 1], dirs[i + 2]))
+                for i in range(0, width * height * 3, 3)]
+
+        start_time = time.perf_counter()
+        for i in range(num_frames):
+            hits = [closest_hit(ray, objects) for ray in rays]
+        primary_time = (time.perf_counter() - start_time) / (num_frames * len(rays))
+
+        # like raytracer.in_shadow: only the points which face the light
+        shadow_rays = [Ray(hit.point, light_dir) for hit in hits
+                       if hit is not None and hit.normal.dot(light_dir) > 0.0]
+
+        # shadow rays traced by reusing the closest-hit search...
+        start_time = time.perf_counter()
+        for i in range(num_frames):
+            expected = [closest_hit(ray, objects) is not None for ray in shadow_rays]
+        closest_time = (time.perf_counter() - start_time) / (num_frames * len(shadow_rays))
+
+        # ...and with the any-hit query
+        start_time = time.perf_counter()
+        for i in range(num_frames):
+            shadowed = [occluded(ray, objects) for ray in shadow_rays]
+        any_time = (time.perf_counter() - start_time) / (num_frames * len(shadow_rays))
+        assert shadowed == expected
+
+        print(f"{name:>12} {primary_time * 1e6:>9.2f} {len(shadow_rays):>12}"
+              f" {closest_time * 1e6:>12.2f} {any_time * 1e6:>9.2f}"
+              f" {closest_time / any_time:>7.1f}x"
+              f" {sum(shadowed) / len(shadow_rays):>9.0%}")
+    print("=" * 72)
 
 
 def benchmark():
     """Run rendering benchmark"""
+    if SCENE_SWEEP:
+        return benchmark_scene_sizes()
+    if SHADOW_BENCH:
+        return benchmark_shadows()
+    if BACKEND == 'parallel':
+        return benchmark_parallel()
+
     width = 80
     height = 30
     num_frames = 100
+    if BACKEND == 'numpy':
+        render = render_frame_numpy
+    elif BACKEND == 'spy':
+        render = render_frame_spy
+    else:
+        render = render_frame
+    camera = Camera(Vec3(0, 0, 0), 3.14159265359 / 3)
 
     print(f"Benchmarking raytracer...")
+    print(f"Backend: {BACKEND}{' (batch)' if BATCH else ''}")
     print(f"Resolution: {width}x{height}")
     print(f"Frames: {num_frames}")
     print(f"Total rays: {width * height * num_frames:,}")
@@ -48,15 +300,20 @@ def benchmark():
     print("Warming up...")
     for i in range(5):
         ball_pos = Vec3(-2.0 + i * 0.5, 0.0, -4.0)
-        render_frame(width, height, ball_pos)
+        render(width, height, ball_pos, camera)
 
     # Benchmark
     print("Running benchmark...")
     start_time = time.time()
 
-    for i in range(num_frames):
-        ball_pos = Vec3(-2.0 + i * 0.05, 0.0, -4.0)
-        render_frame(width, height, ball_pos)
+    if BATCH:
+        render_batch(width, height,
+                     [Vec3(-2.0 + i * 0.05, 0.0, -4.0) for i in range(num_frames)],
+                     camera)
+    else:
+        for i in range(num_frames):
+            ball_pos = Vec3(-2.0 + i * 0.05, 0.0, -4.0)
+            render(width, height, ball_pos, camera)
 
     end_time = time.time()
     elapsed = end_time - start_time
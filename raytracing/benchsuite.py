@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""Benchmark suite comparing the raytracer backends.
+
+`bench.py` and `bench.spy` print ad-hoc numbers for a single run. This script
+renders the same bouncing ball scene with every available backend, sweeping
+the resolution and the number of spheres. Each configuration gets some
+warm-up frames and several timed trials. The results (median and quartiles
+of the time per frame) are saved as JSON, so that runs on different
+machines or commits can be compared:
+
+    ./benchsuite.py run -o before.json
+    [...change something...]
+    ./benchsuite.py run -o after.json
+    ./benchsuite.py compare before.json after.json
+
+The `spy` backend calls the cffi bindings of raytracer.spy (see
+raytracer_spy.py) like any other renderer. The `spy-interp` and
+`spy-compiled` backends run bench.spy in a subprocess: SPy programs take no
+arguments, so for each configuration bench_config.spy is rewritten with the
+resolution and the same scene as the other backends (and bench.spy is
+compiled again), then restored at the end.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from raytracer import Vec3, Ray, Sphere, Plane, Camera, BVH, trace_ray
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+PY_BACKENDS = ['python', 'bvh', 'numpy', 'parallel', 'incremental', 'spy']
+SPY_BACKENDS = ['spy-interp', 'spy-compiled']
+
+
+# ==== scene ====
+
+def make_static_objects(num_spheres: int, seed: int = 42) -> list:
+    """
+    The static part of the demo scene: the blue sphere, the ground, and
+    num_spheres - 2 random spheres, so that together with the ball there
+    are num_spheres spheres.
+    """
+    rng = random.Random(seed)
+    objects = [
+        Sphere(Vec3(2.5, -0.3, -6), 1.0, (0.3, 0.3, 1.0)),
+        Plane(Vec3(0, -1.5, 0), Vec3(0, 1, 0), (0.7, 0.7, 0.7))
+    ]
+    extra = num_spheres - 2
+    if extra > 0:
+        radius = 1.5 / extra ** (1 / 3)
+        for i in range(extra):
+            center = Vec3(rng.uniform(-8, 8), rng.uniform(-1.5, 4), rng.uniform(-20, -7))
+            color = (rng.random(), rng.random(), rng.random())
+            objects.append(Sphere(center, radius * rng.uniform(0.5, 1.5), color))
+    return objects
+
+
+def make_objects(frame: int, static_objects: list) -> list:
+    ball = Sphere(Vec3(-2.0 + (frame % 100) * 0.05, 0.0, -4.0), 0.8, (1.0, 0.3, 0.3))
+    return [ball] + static_objects
+
+
+# ==== Python backends ====
+
+def trace_frame(width: int, height: int, objects, light_dir: Vec3, camera: Camera) -> None:
+    dirs = camera.directions(width, height)
+    for i in range(0, width * height * 3, 3):
+        direction = Vec3(dirs[i], dirs[i + 1], dirs[i + 2])
+        trace_ray(Ray(camera.pos, direction), objects, light_dir)
+
+
+def trace_frame_bvh(width: int, height: int, objects, light_dir: Vec3,
+                    camera: Camera) -> None:
+    # the ball moves at every frame: the cost of the build is part of the frame
+    trace_frame(width, height, BVH(objects), light_dir, camera)
+
+
+def make_renderer(backend: str):
+    """
+    Return a function render(width, height, objects, light_dir, camera) for
+    the given backend, or raise ImportError if it is not available.
+    """
+    if backend == 'python':
+        return trace_frame
+    elif backend == 'bvh':
+        return trace_frame_bvh
+    elif backend == 'numpy':
+        from raytracer_np import render_np
+        return render_np
+    elif backend == 'parallel':
+        from raytracer_mp import default_renderer
+        return default_renderer().render
+    elif backend == 'incremental':
+        from raytracer_inc import IncrementalRenderer
+        return IncrementalRenderer().render
+    elif backend == 'spy':
+        from raytracer_spy import render_objects_rgb
+        return render_objects_rgb
+    raise ValueError(f'unknown backend: {backend!r}')
+
+
+def summarize(times: list, rays_per_frame: int) -> dict:
+    """Statistics of a list of times per frame, in seconds"""
+    if len(times) > 1:
+        q1, median, q3 = statistics.quantiles(times, n=4, method='inclusive')
+    else:
+        q1 = median = q3 = times[0]
+    return {
+        'trials': len(times),
+        'median_ms': median * 1000,
+        'q1_ms': q1 * 1000,
+        'q3_ms': q3 * 1000,
+        'iqr_ms': (q3 - q1) * 1000,
+        'fps': 1 / median,
+        'us_per_ray': median / rays_per_frame * 1e6,
+    }
+
+
+def bench_python(backend: str, width: int, height: int, num_spheres: int,
+                 frames: int, trials: int, warmup: int) -> dict:
+    render = make_renderer(backend)
+    static_objects = make_static_objects(num_spheres)
+    light_dir = Vec3(0.5, 1, 0.3).normalize()
+    camera = Camera(Vec3(0, 0, 0), 3.14159265359 / 3)
+
+    frame = 0
+    for i in range(warmup):
+        render(width, height, make_objects(frame, static_objects), light_dir, camera)
+        frame += 1
+
+    times = []
+    for i in range(trials):
+        start_time = time.perf_counter()
+        for j in range(frames):
+            render(width, height, make_objects(frame, static_objects), light_dir, camera)
+            frame += 1
+        times.append((time.perf_counter() - start_time) / frames)
+
+    result = {'backend': backend, 'width': width, 'height': height,
+              'spheres': num_spheres, 'frames': frames}
+    result.update(summarize(times, width * height))
+    return result
+
+
+# ==== SPy backends ====
+
+SPY_CONFIG = os.path.join(HERE, 'bench_config.spy')
+
+
+def spy_float(x: float) -> str:
+    return repr(float(x))
+
+
+def spy_vec3(v: Vec3) -> str:
+    return f'Vec3({spy_float(v.x)}, {spy_float(v.y)}, {spy_float(v.z)})'
+
+
+def spy_color(color: tuple) -> str:
+    return 'Color(' + ', '.join(spy_float(c) for c in color) + ')'
+
+
+def spy_config(width: int, height: int, num_spheres: int, frames: int) -> str:
+    """
+    Source of a bench_config.spy which makes bench.spy render the same scene
+    as bench_python, at the given resolution
+    """
+    objects = make_objects(0, make_static_objects(num_spheres))
+    spheres = [obj for obj in objects if isinstance(obj, Sphere)]
+    planes = [obj for obj in objects if isinstance(obj, Plane)]
+    lines = [
+        '"""Generated by benchsuite.py, see bench_config.spy in git"""',
+        '',
+        'from unsafe import ptr',
+        'from raytracer import Vec3, Color, Sphere, Plane, Scene, scene_new, '
+        'scene_add_sphere, scene_add_plane',
+        '',
+        '',
+        'def config_enabled() -> bool:',
+        '    return True',
+        '',
+        '',
+        'def config_width() -> i32:',
+        f'    return {width}',
+        '',
+        '',
+        'def config_height() -> i32:',
+        f'    return {height}',
+        '',
+        '',
+        'def config_frames() -> i32:',
+        f'    return {frames}',
+        '',
+        '',
+        'def make_config_scene() -> ptr[Scene]:',
+        f'    scene = scene_new({len(spheres)}, {len(planes)})',
+    ]
+    # the ball comes first: bench.spy moves scene.spheres[0]
+    for sphere in spheres:
+        lines.append(f'    scene_add_sphere(scene, Sphere({spy_vec3(sphere.center)}, '
+                     f'{spy_float(sphere.radius)}, {spy_color(sphere.color)}))')
+    for plane in planes:
+        lines.append(f'    scene_add_plane(scene, Plane({spy_vec3(plane.point)}, '
+                     f'{spy_vec3(plane.normal)}, {spy_color(plane.color)}))')
+    lines.append('    return scene')
+    return '\n'.join(lines) + '\n'
+
+def spy_command(backend: str) -> list:
+    """Build bench.spy if needed and return the command which runs it"""
+    if backend == 'spy-interp':
+        return ['spy', '-rx', '--error-mode=lazy', 'bench.spy']
+    subprocess.run(['spy', '-c', '--release', '--error-mode=lazy', 'bench.spy'],
+                   cwd=HERE, check=True, stdout=subprocess.DEVNULL)
+    return [os.path.join(HERE, 'build', 'bench')]
+
+
+def parse_bench_output(output: str) -> tuple:
+    """Return (width, height, frames, elapsed) from the output of bench.spy"""
+    width, height = re.search(r'Resolution: (\d+)x(\d+)', output).groups()
+    frames = re.search(r'Frames: (\d+)', output).group(1)
+    elapsed = re.search(r'Total time: ([0-9.eE+-]+)', output).group(1)
+    return int(width), int(height), int(frames), float(elapsed)
+
+
+def bench_spy(backend: str, width: int, height: int, num_spheres: int,
+              frames: int, trials: int) -> dict:
+    with open(SPY_CONFIG, 'w') as f:
+        f.write(spy_config(width, height, num_spheres, frames))
+    # bench.spy does its own warm-up
+    cmd = spy_command(backend)
+    times = []
+    for i in range(trials):
+        proc = subprocess.run(cmd, cwd=HERE, check=True, capture_output=True, text=True)
+        width, height, frames, elapsed = parse_bench_output(proc.stdout)
+        times.append(elapsed / frames)
+
+    result = {'backend': backend, 'width': width, 'height': height,
+              'spheres': num_spheres, 'frames': frames}
+    result.update(summarize(times, width * height))
+    return result
+
+
+# ==== driver ====
+
+def machine_info() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_implementation() + ' ' + platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def print_result(r: dict) -> None:
+    config = f"{r['backend']:>13} {r['width']:>4}x{r['height']:<4} {r['spheres']:>6}"
+    print(f"{config} {r['median_ms']:>11.3f} {r['iqr_ms']:>9.3f}"
+          f" {r['fps']:>10.1f} {r['us_per_ray']:>10.3f}")
+
+
+def run(args) -> None:
+    sizes = [tuple(int(n) for n in size.split('x')) for size in args.sizes.split(',')]
+    sphere_counts = [int(n) for n in args.spheres.split(',')]
+
+    results = []
+    skipped = {}
+    print(f"{'backend':>13} {'size':^9} {'spheres':>6} {'median ms':>11} {'IQR ms':>9}"
+          f" {'FPS':>10} {'µs/ray':>10}")
+    print("=" * 74)
+    with open(SPY_CONFIG) as f:
+        spy_config_source = f.read()
+    try:
+        for backend in args.backends.split(','):
+            if backend in SPY_BACKENDS:
+                if shutil.which('spy') is None:
+                    skipped[backend] = 'spy not found in PATH'
+                    continue
+            else:
+                try:
+                    make_renderer(backend)
+                except ImportError as e:
+                    skipped[backend] = str(e)
+                    continue
+            for width, height in sizes:
+                for num_spheres in sphere_counts:
+                    if backend in SPY_BACKENDS:
+                        result = bench_spy(backend, width, height, num_spheres,
+                                           args.frames, args.trials)
+                    else:
+                        result = bench_python(backend, width, height, num_spheres,
+                                              args.frames, args.trials, args.warmup)
+                    print_result(result)
+                    results.append(result)
+    finally:
+        with open(SPY_CONFIG, 'w') as f:
+            f.write(spy_config_source)
+    print("=" * 74)
+    for backend, reason in skipped.items():
+        print(f"skipped {backend}: {reason}")
+
+    if args.output:
+        data = {'machine': machine_info(), 'results': results}
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=2)
+        print(f"results written to {args.output}")
+
+
+def result_key(r: dict) -> tuple:
+    return (r['backend'], r['width'], r['height'], r['spheres'])
+
+
+def compare(args) -> int:
+    """Compare two result files, return the number of regressions"""
+    with open(args.baseline) as f:
+        baseline = {result_key(r): r for r in json.load(f)['results']}
+    with open(args.current) as f:
+        current = json.load(f)['results']
+
+    regressions = 0
+    print(f"{'backend':>13} {'size':^9} {'spheres':>6} {'base ms':>10} {'now ms':>10}"
+          f" {'change':>8}")
+    print("=" * 64)
+    for r in current:
+        base = baseline.get(result_key(r))
+        if base is None:
+            continue
+        change = r['median_ms'] / base['median_ms'] - 1
+        # a regression must be bigger than the threshold *and* than the noise:
+        # the quartiles of the two runs must not overlap
+        status = ''
+        if change > args.threshold and r['q1_ms'] > base['q3_ms']:
+            status = 'REGRESSION'
+            regressions += 1
+        elif change < -args.threshold and r['q3_ms'] < base['q1_ms']:
+            status = 'faster'
+        config = f"{r['backend']:>13} {r['width']:>4}x{r['height']:<4} {r['spheres']:>6}"
+        print(f"{config} {base['median_ms']:>10.3f} {r['median_ms']:>10.3f}"
+              f" {change:>+8.1%} {status}")
+    print("=" * 64)
+    print(f"{regressions} regression(s) above {args.threshold:.0%}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the raytracer backends."
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('run', help="Run the benchmarks")
+    p.add_argument('--backends', default=','.join(PY_BACKENDS + SPY_BACKENDS),
+                   help="Comma-separated list of backends")
+    p.add_argument('--sizes', default='40x15,80x30,160x60',
+                   help="Comma-separated list of resolutions, e.g. 80x30")
+    p.add_argument('--spheres', default='2,20,200',
+                   help="Comma-separated list of sphere counts")
+    p.add_argument('--frames', type=int, default=5, help="Frames per trial")
+    p.add_argument('--trials', type=int, default=5, help="Timed trials")
+    p.add_argument('--warmup', type=int, default=2, help="Warm-up frames")
+    p.add_argument('-o', '--output', help="Write the results to this JSON file")
+
+    p = subparsers.add_parser('compare', help="Compare two JSON result files")
+    p.add_argument('baseline')
+    p.add_argument('current')
+    p.add_argument('--threshold', type=float, default=0.05,
+                   help="Relative slowdown which counts as a regression")
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    elif compare(args):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
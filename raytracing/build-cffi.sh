@@ -0,0 +1,7 @@
+export SPY_ROOT=$(python -c 'import spy; print(spy.ROOT)')
+
+rm -rf build
+rm -f _raytracer_spy.c _raytracer_spy.o
+rm -f _raytracer_spy.*.so
+spy --cwrite raytracer.spy || exit
+python cffi_build.py
@@ -0,0 +1,55 @@
+import os
+from pathlib import Path
+from cffi import FFI
+
+ffibuilder = FFI()
+
+ffibuilder.cdef("""
+void render_rgb(uint8_t *out, int32_t width, int32_t height, double fov,
+                double ball_x, double ball_y, double ball_z, int32_t shadows);
+void render_rgb_batch(uint8_t *out, int32_t n_frames, int32_t width, int32_t height,
+                      double fov, double *balls, int32_t shadows);
+void render_objects_rgb(uint8_t *out, int32_t width, int32_t height, double fov,
+                        double *spheres, int32_t n_spheres, double *planes,
+                        int32_t n_planes, double light_x, double light_y,
+                        double light_z, int32_t shadows);
+""")
+
+src = """
+#define render_rgb spy_raytracer$render_rgb
+#define render_rgb_batch spy_raytracer$render_rgb_batch
+#define render_objects_rgb spy_raytracer$render_objects_rgb
+
+void spy_raytracer$render_rgb(uint8_t *out, int32_t width, int32_t height, double fov,
+                              double ball_x, double ball_y, double ball_z,
+                              int32_t shadows);
+void spy_raytracer$render_rgb_batch(uint8_t *out, int32_t n_frames, int32_t width,
+                                    int32_t height, double fov, double *balls,
+                                    int32_t shadows);
+void spy_raytracer$render_objects_rgb(uint8_t *out, int32_t width, int32_t height,
+                                      double fov, double *spheres, int32_t n_spheres,
+                                      double *planes, int32_t n_planes, double light_x,
+                                      double light_y, double light_z, int32_t shadows);
+"""
+
+SPY_ROOT = Path(os.environ["SPY_ROOT"]).absolute()
+TARGET = "native"
+
+ffibuilder.set_source(
+    "_raytracer_spy",
+    src,
+    # raytracer.c plus the modules which it imports, e.g. strbuilder.c
+    sources=[str(p) for p in sorted(Path("build/src").glob("*.c"))],
+    libraries=["spy"],
+    define_macros=[
+        (f"SPY_TARGET_{TARGET.upper()}", None),
+        ("SPY_RELEASE", None),
+    ],
+    include_dirs=[f"{SPY_ROOT}/libspy/include"],
+    library_dirs=[f"{SPY_ROOT}/libspy/build/{TARGET}/release"],
+    extra_compile_args = ['-O3'],
+)
+
+
+if __name__ == "__main__":
+    ffibuilder.compile(verbose=True)
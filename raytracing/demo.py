@@ -5,82 +5,224 @@ import math
 import time
 import sys
 import os
-from raytracer import Vec3, Ray, Sphere, Plane, trace_ray
-
+import json
+from raytracer import Vec3, Ray, Sphere, Plane, Camera, trace_ray, enable_stats
+from ansi import FrameEncoder, output_size, rgb_to_half_blocks
+from pacing import FramePacer, ResolutionController, upscale
+import physics
+from physics import Ball, Trajectory, simulate
+
+# if True, render BENCHMARK_FRAMES frames of BENCHMARK_SIZE without displaying
+# them, always with the same fixed-timestep trajectory of the ball (or the one
+# in REPLAY), so that the results can be compared across backends and runs
 BENCHMARK = False
-
-
-def render_frame(width: int, height: int, ball_pos: Vec3) -> str:
-    """Render frame to a string buffer"""
-    # Scene setup
-    objects = [
+BENCHMARK_FRAMES = 300
+BENCHMARK_SIZE = (120, 40)
+
+# 'python': trace one pixel at a time with raytracer.trace_ray
+# 'numpy': trace the whole frame at once with raytracer_np (needs numpy)
+# 'parallel': trace bands of rows on all the cores with raytracer_mp
+# 'incremental': re-trace only the pixels around the ball with raytracer_inc
+# 'spy': render with the compiled raytracer.spy (build it with ./build-cffi.sh)
+BACKEND = 'python'
+
+# True: send only the cells which changed since the previous frame, see ansi.py
+# False: redraw the whole screen at every frame
+DELTA_OUTPUT = True
+
+# True: draw two pixels per cell with half blocks (see ansi.py), which doubles
+# the vertical resolution; False: one pixel per cell
+HALF_BLOCKS = False
+
+# if set, show the frames at this rate: when they take too long to render,
+# lower the internal resolution and upscale them to the terminal, and raise it
+# again when there is headroom (see pacing.py). None: render every frame at
+# the size of the terminal, as fast as possible
+TARGET_FPS = None
+
+# Fixed-timestep mode, see physics.py: if FIXED_DT is set, the ball advances by
+# FIXED_DT seconds at every frame instead of by the wall-clock time between
+# frames, so that every run shows the same frames. BENCHMARK always uses it,
+# with physics.FIXED_DT by default. SEED randomizes the launches of the ball.
+FIXED_DT = None
+SEED = None
+
+# if set, replay the trajectory of the ball saved in this file, e.g. to render
+# exactly the same frames with every backend; if RECORD is set, save the
+# trajectory of the ball to this file on exit
+REPLAY = None
+RECORD = None
+
+# if True, smooth the edges of the objects with raytracer_aa, which traces
+# extra sub-pixel rays only around them (in Python, whatever the BACKEND)
+ANTIALIAS = False
+
+# if True, the objects cast shadows: each hit traces a shadow ray towards the
+# light, see raytracer.occluded
+SHADOWS = False
+
+# if True, measure where the time goes (see raytracer.enable_stats) and print
+# it on exit; if STATS_JSON is set, also save it to that file
+STATS = False
+STATS_JSON = None
+
+
+def make_objects(ball_pos: Vec3) -> list:
+    return [
         Sphere(ball_pos, 0.8, (1.0, 0.3, 0.3)),              # Bouncing red ball
         Sphere(Vec3(2.5, -0.3, -6), 1.0, (0.3, 0.3, 1.0)),   # Static blue sphere
         Plane(Vec3(0, -1.5, 0), Vec3(0, 1, 0), (0.7, 0.7, 0.7))  # Ground
     ]
 
+
+def render_frame(width: int, height: int, ball_pos: Vec3, camera: Camera) -> str:
+    """Render frame to a string buffer"""
+    pixels = render_frame_rgb(width, height, ball_pos, camera)
+    if HALF_BLOCKS:
+        return rgb_to_half_blocks(pixels, width, height)
+    return rgb_to_ansi(pixels, width, height)
+
+
+def render_frame_rgb(width: int, height: int, ball_pos: Vec3, camera: Camera) -> bytes:
+    """Render frame as raw RGB24 bytes"""
+    if ANTIALIAS:
+        return render_frame_rgb_aa(width, height, ball_pos, camera)
+    elif BACKEND == 'numpy':
+        return render_frame_rgb_numpy(width, height, ball_pos, camera)
+    elif BACKEND == 'parallel':
+        return render_frame_rgb_parallel(width, height, ball_pos, camera)
+    elif BACKEND == 'incremental':
+        return render_frame_rgb_incremental(width, height, ball_pos, camera)
+    elif BACKEND == 'spy':
+        return render_frame_rgb_spy(width, height, ball_pos, camera)
+
+    # Scene setup
+    objects = make_objects(ball_pos)
+
     light_dir = Vec3(0.5, 1, 0.3).normalize()
-    camera_pos = Vec3(0, 0, 0)
 
-    aspect_ratio = width / height
-    fov = math.pi / 3
+    # Ray directions are cached by the camera across frames
+    dirs = camera.directions(width, height)
 
-    # Build frame in memory
-    buffer = []
+    pixels = bytearray(width * height * 3)
 
-    for y in range(height):
-        line = []
-        for x in range(width):
-            # Calculate ray direction
-            px = (2 * (x + 0.5) / width - 1) * aspect_ratio * math.tan(fov / 2)
-            py = (1 - 2 * (y + 0.5) / height) * math.tan(fov / 2)
+    for i in range(0, width * height * 3, 3):
+        direction = Vec3(dirs[i], dirs[i + 1], dirs[i + 2])
+        ray = Ray(camera.pos, direction)
 
-            direction = Vec3(px, py, -1).normalize()
-            ray = Ray(camera_pos, direction)
+        # Trace ray
+        r, g, b = trace_ray(ray, objects, light_dir, SHADOWS)
 
-            # Trace ray
-            r, g, b = trace_ray(ray, objects, light_dir)
+        # Convert to 8-bit color
+        pixels[i] = int(min(255, r * 255))
+        pixels[i + 1] = int(min(255, g * 255))
+        pixels[i + 2] = int(min(255, b * 255))
 
-            # Convert to 8-bit color
-            r_int = int(min(255, r * 255))
-            g_int = int(min(255, g * 255))
-            b_int = int(min(255, b * 255))
+    return pixels
 
-            # Use ANSI 24-bit color escape code
-            line.append(f'\033[48;2;{r_int};{g_int};{b_int}m ')
 
-        # Reset color at end of line
-        line.append('\033[0m\n')
-        buffer.append(''.join(line))
+def render_frame_rgb_numpy(width: int, height: int, ball_pos: Vec3, camera: Camera) -> bytes:
+    """Same as render_frame_rgb, but trace all the rays at once with numpy"""
+    from raytracer_np import render_np
+    objects = make_objects(ball_pos)
+    light_dir = Vec3(0.5, 1, 0.3).normalize()
+    return render_np(width, height, objects, light_dir, camera, SHADOWS).tobytes()
 
-    return ''.join(buffer)
 
+def render_frame_rgb_parallel(width: int, height: int, ball_pos: Vec3, camera: Camera) -> bytes:
+    """Same as render_frame_rgb, but trace the rays on all the cores"""
+    from raytracer_mp import default_renderer
+    objects = make_objects(ball_pos)
+    light_dir = Vec3(0.5, 1, 0.3).normalize()
+    return bytes(default_renderer().render(width, height, objects, light_dir, camera, SHADOWS))
 
-def animate():
-    # Get terminal size
-    term_size = os.get_terminal_size()
-    width = term_size.columns
-    height = term_size.lines - 2  # Reserve 2 lines for info text
 
-    # Physics parameters
-    gravity = 9.8
+def render_frame_rgb_incremental(width: int, height: int, ball_pos: Vec3,
+                                 camera: Camera) -> bytes:
+    """Same as render_frame_rgb, but re-trace only the pixels which can change"""
+    from raytracer_inc import default_renderer
+    objects = make_objects(ball_pos)
+    light_dir = Vec3(0.5, 1, 0.3).normalize()
+    return default_renderer().render(width, height, objects, light_dir, camera, SHADOWS)
 
-    # Ball initial position (up-left)
-    x0 = -2.0
-    y0 = 2.0
-    z0 = -4.0
 
-    # Initial velocity
-    vx = 1.5  # Move right
-    vy = 0.0
-    vz = 0.0
+def render_frame_rgb_aa(width: int, height: int, ball_pos: Vec3, camera: Camera) -> bytearray:
+    """
+    Same as render_frame_rgb, but anti-aliased: the edge pixels are
+    supersampled by raytracer_aa.
+    """
+    from raytracer_aa import default_renderer
+    objects = make_objects(ball_pos)
+    light_dir = Vec3(0.5, 1, 0.3).normalize()
+    return default_renderer().render(width, height, objects, light_dir, camera, SHADOWS)
 
-    # Current position and velocity
-    x, y, z = x0, y0, z0
 
-    # Bounce parameters
-    ground_y = -1.5 + 0.8  # ground plane + ball radius
-    damping = 0.7  # Energy loss on bounce
+def render_frame_rgb_spy(width: int, height: int, ball_pos: Vec3, camera: Camera) -> bytes:
+    """
+    Same as render_frame_rgb, but render with the compiled raytracer.spy.
+    Only the field of view of the camera is used: it must be at the origin.
+    """
+    from raytracer_spy import render_rgb
+    return render_rgb(width, height, ball_pos, camera, shadows=SHADOWS)
+
+
+def rgb_to_ansi(pixels: bytes, width: int, height: int) -> str:
+    """Turn a RGB24 framebuffer into ANSI escape codes, one cell per pixel"""
+    buffer = []
+    row_size = width * 3
+    for y in range(height):
+        row = pixels[y * row_size:(y + 1) * row_size]
+        line = [f'\033[48;2;{row[i]};{row[i+1]};{row[i+2]}m '
+                for i in range(0, row_size, 3)]
+        line.append('\033[0m\n')
+        buffer.append(''.join(line))
+    return ''.join(buffer)
+
+
+def animate():
+    if BENCHMARK:
+        width, height = BENCHMARK_SIZE
+    else:
+        # Get terminal size
+        term_size = os.get_terminal_size()
+        width = term_size.columns
+        height = term_size.lines - 2  # Reserve 2 lines for info text
+        if HALF_BLOCKS:
+            height *= 2
+
+    # The camera never moves: it caches the ray directions across frames
+    camera = Camera(Vec3(0, 0, 0), math.pi / 3)
+
+    # Remembers what is on the screen, to send only what changed
+    encoder = FrameEncoder(half_blocks=HALF_BLOCKS)
+    # lines of the terminal taken by a frame
+    lines = (height + 1) // 2 if HALF_BLOCKS else height
+    frame_bytes = 0
+    encode_time = 0.0
+    total_bytes = 0
+    total_encode_time = 0.0
+
+    stats = enable_stats() if STATS else None
+
+    # Frame pacing and dynamic resolution
+    pacer = FramePacer(TARGET_FPS)
+    controller = ResolutionController(TARGET_FPS) if TARGET_FPS else None
+    render_width, render_height = width, height
+
+    # Ball physics: either simulated frame by frame, or a precomputed
+    # trajectory with one state per frame
+    step_dt = FIXED_DT or (physics.FIXED_DT if BENCHMARK else None)
+    if REPLAY:
+        trajectory = Trajectory.load(REPLAY)
+    elif BENCHMARK:
+        trajectory = simulate(BENCHMARK_FRAMES, step_dt, SEED)
+    else:
+        trajectory = None
+    ball = Ball(SEED)
+    if trajectory is not None:
+        recorded = Trajectory(trajectory.dt, trajectory.seed)
+    else:
+        recorded = Trajectory(step_dt, SEED)
 
     # FPS tracking
     frame_count = 0
@@ -94,10 +236,9 @@ def animate():
         # Hide cursor
         print('\033[?25l', end='')
 
-    last_frame_time = time.time()
+    last_frame_time = start_time = time.time()
 
     try:
-        max_frames = 300 if BENCHMARK else None
         while True:
             # Measure actual frame time
             current_time = time.time()
@@ -105,46 +246,84 @@ def animate():
             last_frame_time = current_time
 
             # Update physics
-            vy -= gravity * dt
-            y += vy * dt
-            x += vx * dt
-            z += vz * dt
-
-            # Check for ground collision
-            if y <= ground_y:
-                y = ground_y
-                vy = -vy * damping
+            if trajectory is not None:
+                if frame_count >= len(trajectory):
+                    break
+                state = trajectory.states[frame_count]
+            else:
+                ball.step(step_dt or dt)
+                state = ball.state()
+            recorded.states.append(state)
+            x, y, z, vx, vy, vz = state
 
-                # Stop bouncing if velocity is too small
-                if abs(vy) < 0.3:
-                    vy = 0
+            if not BENCHMARK:
+                # Follow terminal resizes: the camera recomputes the ray
+                # directions only when the size actually changes
+                term_size = os.get_terminal_size()
+                if (term_size.columns, term_size.lines - 2) != (width, lines):
+                    width = term_size.columns
+                    lines = term_size.lines - 2
+                    height = lines * 2 if HALF_BLOCKS else lines
+                    sys.stdout.write('\033[2J')
+                    encoder.reset()
 
             # Render current frame to buffer
             ball_pos = Vec3(x, y, z)
             if not BENCHMARK:
-                frame = render_frame(width, height, ball_pos)
+                frame_start = t0 = time.perf_counter()
+                if controller:
+                    render_width, render_height = controller.size(width, height)
+                else:
+                    render_width, render_height = width, height
+                pixels = render_frame_rgb(render_width, render_height, ball_pos, camera)
+                pixels = upscale(pixels, render_width, render_height, width, height)
+                if stats:
+                    stats.add_time('render (total)', time.perf_counter() - t0)
+                t0 = time.perf_counter()
+                if DELTA_OUTPUT:
+                    frame = encoder.encode(pixels, width, height)
+                elif HALF_BLOCKS:
+                    frame = '\033[H' + rgb_to_half_blocks(pixels, width, height)
+                else:
+                    frame = '\033[H' + rgb_to_ansi(pixels, width, height)
+                encode_time = time.perf_counter() - t0
+                frame_bytes = output_size(frame)
+                total_bytes += frame_bytes
+                total_encode_time += encode_time
+                if stats:
+                    stats.add_time('encode', encode_time)
+            elif BACKEND == 'numpy':
+                from raytracer_np import render_np
+                objects = make_objects(ball_pos)
+                light_dir = Vec3(0.5, 1, 0.3).normalize()
+                render_np(width, height, objects, light_dir, camera, SHADOWS)
+            elif BACKEND == 'parallel':
+                from raytracer_mp import default_renderer
+                objects = make_objects(ball_pos)
+                light_dir = Vec3(0.5, 1, 0.3).normalize()
+                default_renderer().render(width, height, objects, light_dir, camera, SHADOWS)
+            elif BACKEND == 'incremental':
+                from raytracer_inc import default_renderer
+                objects = make_objects(ball_pos)
+                light_dir = Vec3(0.5, 1, 0.3).normalize()
+                default_renderer().render(width, height, objects, light_dir, camera, SHADOWS)
+            elif BACKEND == 'spy':
+                render_frame_rgb_spy(width, height, ball_pos, camera)
             else:
                 # In benchmark mode, still trace rays but don't build frame string
-                objects = [
-                    Sphere(ball_pos, 0.8, (1.0, 0.3, 0.3)),
-                    Sphere(Vec3(2.5, -0.3, -6), 1.0, (0.3, 0.3, 1.0)),
-                    Plane(Vec3(0, -1.5, 0), Vec3(0, 1, 0), (0.7, 0.7, 0.7))
-                ]
+                objects = make_objects(ball_pos)
                 light_dir = Vec3(0.5, 1, 0.3).normalize()
-                camera_pos = Vec3(0, 0, 0)
-                aspect_ratio = width / height
-                fov = math.pi / 3
-
-                for py in range(height):
-                    for px in range(width):
-                        px_norm = (2 * (px + 0.5) / width - 1) * aspect_ratio * math.tan(fov / 2)
-                        py_norm = (1 - 2 * (py + 0.5) / height) * math.tan(fov / 2)
-                        direction = Vec3(px_norm, py_norm, -1).normalize()
-                        ray = Ray(camera_pos, direction)
-                        trace_ray(ray, objects, light_dir)
+                dirs = camera.directions(width, height)
+
+                for i in range(0, width * height * 3, 3):
+                    direction = Vec3(dirs[i], dirs[i + 1], dirs[i + 2])
+                    ray = Ray(camera.pos, direction)
+                    trace_ray(ray, objects, light_dir, SHADOWS)
 
             # Update FPS counter
             frame_count += 1
+            if stats:
+                stats.count('frames')
             if frame_count % fps_update_interval == 0:
                 elapsed = current_time - last_fps_time
                 fps = fps_update_interval / elapsed
@@ -155,20 +334,31 @@ def animate():
 
             if not BENCHMARK:
                 # Display info
-                info = f"\nBall position: ({x:.2f}, {y:.2f}, {z:.2f}) | velocity: {vy:.2f} | FPS: {fps:.1f} | Press Ctrl+C to exit"
-
-                # Move cursor to home and output everything at once
-                sys.stdout.write('\033[H' + frame + info)
+                mode = 'half blocks' if HALF_BLOCKS else 'full blocks'
+                p50, p95, p99 = pacer.percentiles(50, 95, 99)
+                info = (f"Ball position: ({x:.2f}, {y:.2f}, {z:.2f}) | velocity: {vy:.2f} | FPS: {fps:.1f} | "
+                        f"{render_width}x{render_height} | frame p50/p95/p99: {p50 * 1000:.0f}/"
+                        f"{p95 * 1000:.0f}/{p99 * 1000:.0f} ms | "
+                        f"{frame_bytes / 1024:.1f} KB/frame ({mode}), "
+                        f"encode {encode_time * 1000:.1f} ms | ")
+                if ANTIALIAS:
+                    from raytracer_aa import default_renderer
+                    rays = default_renderer().rays
+                    info += f"{rays} rays/frame ({rays / (render_width * render_height) - 1:+.0%}) | "
+                info += "Press Ctrl+C to exit"
+
+                # Output everything at once; the info goes on the last line
+                t0 = time.perf_counter()
+                sys.stdout.write(frame + f'\033[{lines + 2};1H' + info + '\033[K')
                 sys.stdout.flush()
+                if stats:
+                    stats.add_time('output', time.perf_counter() - t0)
 
-            # Reset if ball goes too far right
-            if x > 5:
-                x, y, z = x0, y0, z0
-                vx, vy, vz = 1.5, 0.0, 0.0
-
-            # Stop after max_frames in benchmark mode
-            if max_frames and frame_count >= max_frames:
-                break
+                # the time spent producing the frame, without the sleep
+                frame_time = time.perf_counter() - frame_start
+                if controller:
+                    controller.update(frame_time)
+                pacer.wait(frame_time)
 
     except KeyboardInterrupt:
         pass
@@ -179,6 +369,25 @@ def animate():
             # Exit alternate screen buffer
             print('\033[?1049l', end='')
         print(f"\nAnimation stopped. Final FPS: {fps:.1f}, Total frames: {frame_count}")
+        if BENCHMARK and frame_count:
+            print(f"Average FPS: {frame_count / (time.time() - start_time):.1f} "
+                  f"({BACKEND}, {width}x{height})")
+        if frame_count and total_bytes:
+            print(f"Output ({'half' if HALF_BLOCKS else 'full'} blocks): "
+                  f"{total_bytes / frame_count / 1024:.1f} KB/frame, "
+                  f"encode {total_encode_time / frame_count * 1000:.2f} ms/frame")
+            p50, p95, p99 = pacer.percentiles(50, 95, 99)
+            print(f"Last resolution: {render_width}x{render_height} of {width}x{height}, "
+                  f"frame time p50/p95/p99: {p50 * 1000:.1f}/{p95 * 1000:.1f}/"
+                  f"{p99 * 1000:.1f} ms")
+        if RECORD:
+            recorded.save(RECORD)
+            print(f"Trajectory of {len(recorded)} frames saved to {RECORD}")
+        if stats:
+            print(stats.report())
+            if STATS_JSON:
+                with open(STATS_JSON, 'w') as f:
+                    json.dump(stats.as_dict(), f, indent=2)
 
 
 if __name__ == '__main__':
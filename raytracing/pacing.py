@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Frame pacing and dynamic resolution for the real-time demos.
+
+The cost of a frame is proportional to the number of pixels, so on a big
+terminal the frame rate can drop far below what is needed for a smooth
+animation. ResolutionController measures how long each frame takes to
+produce, and picks the internal resolution to render at: when the frames
+are over budget it lowers the resolution, and when there is headroom it
+raises it again, up to the full size. The frames are then upscaled to the
+terminal grid by replicating the pixels, see upscale().
+
+FramePacer sleeps between frames, so that they are shown at a regular rate
+instead of as fast as possible.
+"""
+
+import math
+import statistics
+import time
+from collections import deque
+from typing import Tuple
+
+
+def upscale(pixels: bytes, width: int, height: int, out_width: int,
+            out_height: int) -> bytes:
+    """
+    Scale a RGB24 framebuffer to out_width x out_height, by repeating each
+    pixel (nearest neighbor).
+    """
+    if (width, height) == (out_width, out_height):
+        return pixels
+    pixels = bytes(pixels)
+    # source column of each output column, as byte offsets
+    offsets = [(x * width // out_width) * 3 for x in range(out_width)]
+    rows = []
+    last_y = -1
+    row = b''
+    for y in range(out_height):
+        src_y = y * height // out_height
+        if src_y != last_y:
+            src = pixels[src_y * width * 3:(src_y + 1) * width * 3]
+            row = b''.join([src[i:i + 3] for i in offsets])
+            last_y = src_y
+        rows.append(row)
+    return b''.join(rows)
+
+
+class ResolutionController:
+    """
+    Choose the internal resolution so that the frames fit in the budget of
+    1 / target_fps seconds.
+
+    The resolution is `scale` times the output size in each direction, with
+    `min_scale <= scale <= 1`. Call update() with the time spent producing
+    each frame (not including the time spent waiting for the next one): every
+    `window` frames, the median time is compared with the budget. Above
+    `high` times the budget the scale goes down in proportion; below `low`
+    times the budget it goes up by `step`. The gap between the two
+    thresholds avoids oscillating between two resolutions.
+    """
+
+    def __init__(self, target_fps: float, min_scale: float = 0.2, window: int = 10,
+                 high: float = 0.9, low: float = 0.6, step: float = 1.15):
+        self.budget = 1.0 / target_fps
+        self.min_scale = min_scale
+        self.window = window
+        self.high = high
+        self.low = low
+        self.step = step
+        self.scale = 1.0
+        self.times = []
+
+    def size(self, width: int, height: int) -> Tuple[int, int]:
+        """Internal resolution for an output of width x height"""
+        return (max(1, round(width * self.scale)), max(1, round(height * self.scale)))
+
+    def update(self, frame_time: float) -> None:
+        self.times.append(frame_time)
+        if len(self.times) < self.window:
+            return
+        median = statistics.median(self.times)
+        self.times.clear()
+        if median > self.high * self.budget:
+            # the cost is proportional to the number of pixels, i.e. to the
+            # square of the scale: aim at the middle of the two thresholds
+            target = (self.high + self.low) / 2 * self.budget
+            self.scale = max(self.min_scale, self.scale * math.sqrt(target / median))
+        elif median < self.low * self.budget and self.scale < 1.0:
+            self.scale = min(1.0, self.scale * self.step)
+
+
+class FramePacer:
+    """
+    Sleep between frames to show them at target_fps. If a frame is late, the
+    next ones are not rushed to catch up: the schedule restarts from now.
+    With target_fps=None it doesn't sleep at all.
+
+    It also keeps the time spent producing each of the last `history`
+    frames, as passed to wait(), to report percentiles of the frame time.
+    These don't include the sleep: a frame which takes too long shows up
+    even though the pacing hides it from the interval between frames.
+    """
+
+    def __init__(self, target_fps: float = None, history: int = 120):
+        # without a target, never sleep: just measure
+        self.interval = 1.0 / target_fps if target_fps else 0.0
+        self.deadline = None
+        self.frame_times = deque(maxlen=history)
+
+    def wait(self, frame_time: float = None) -> None:
+        """
+        Sleep until it's time to show the next frame. frame_time is the time
+        spent producing the current one, if known.
+        """
+        if frame_time is not None:
+            self.frame_times.append(frame_time)
+        now = time.perf_counter()
+        if self.deadline is None or now > self.deadline:
+            self.deadline = now
+        else:
+            time.sleep(self.deadline - now)
+        self.deadline += self.interval
+
+    def percentiles(self, *ps: float) -> list:
+        """Percentiles of the frame times, in seconds"""
+        if len(self.frame_times) < 2:
+            return [0.0] * len(ps)
+        times = sorted(self.frame_times)
+        return [times[min(len(times) - 1, int(p / 100 * len(times)))] for p in ps]
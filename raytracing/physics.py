@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Physics of the bouncing ball, shared by demo.py and play.py.
+
+In real time the ball advances by the wall-clock time between two frames,
+so two runs never render the same frames, and the work per frame depends on
+where the ball happens to be. For benchmarks the ball can instead advance by
+a fixed time step: simulate() returns a Trajectory, i.e. the state of the
+ball at every frame, which is always the same for a given time step and
+seed. It can be saved to a JSON file and replayed later, so that every
+backend (or every version of the code) renders exactly the same frames.
+"""
+
+import json
+import random
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
+
+GRAVITY = 9.8
+GROUND_Y = -1.5 + 0.8   # ground plane + ball radius
+DAMPING = 0.7           # energy loss on bounce
+
+# launch position (up-left) and velocity (moving right)
+START = (-2.0, 2.0, -4.0)
+START_VELOCITY = (1.5, 0.0, 0.0)
+
+# when the ball goes past this x, it is launched again
+MAX_X = 5.0
+
+# default time step of the fixed-timestep mode
+FIXED_DT = 1 / 30
+
+
+class Ball:
+    """
+    The bouncing ball. With a seed, each launch starts from a random height
+    and with a random horizontal speed; without one, always from START with
+    START_VELOCITY.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self.rng = random.Random(seed) if seed is not None else None
+        self.launch()
+
+    def launch(self) -> None:
+        self.x, self.y, self.z = START
+        self.vx, self.vy, self.vz = START_VELOCITY
+        if self.rng is not None:
+            self.y = self.rng.uniform(1.0, 3.0)
+            self.vx = self.rng.uniform(1.0, 2.0)
+
+    def step(self, dt: float) -> None:
+        """Advance the simulation by dt seconds"""
+        # the frame where the ball went too far is still shown: launch it
+        # again at the next step
+        if self.x > MAX_X:
+            self.launch()
+
+        self.vy -= GRAVITY * dt
+        self.y += self.vy * dt
+        self.x += self.vx * dt
+        self.z += self.vz * dt
+
+        # Check for ground collision
+        if self.y <= GROUND_Y:
+            self.y = GROUND_Y
+            self.vy = -self.vy * DAMPING
+
+            # Stop bouncing if velocity is too small
+            if abs(self.vy) < 0.3:
+                self.vy = 0
+
+    def state(self) -> Tuple[float, float, float, float, float, float]:
+        return (self.x, self.y, self.z, self.vx, self.vy, self.vz)
+
+
+@dataclass
+class Trajectory:
+    """State (x, y, z, vx, vy, vz) of the ball at each frame"""
+    dt: Optional[float]   # None if it was recorded in real time
+    seed: Optional[int]
+    states: list = field(default_factory=list)
+
+    def __len__(self):
+        return len(self.states)
+
+    def positions(self) -> list:
+        """(x, y, z) of the ball at each frame"""
+        return [tuple(state[:3]) for state in self.states]
+
+    def save(self, path: str) -> None:
+        # floats are written with repr(), so they are read back exactly
+        data = {'dt': self.dt, 'seed': self.seed, 'states': self.states}
+        with open(path, 'w') as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, path: str) -> 'Trajectory':
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data['dt'], data['seed'], [tuple(s) for s in data['states']])
+
+
+def simulate(num_frames: int, dt: float = FIXED_DT,
+             seed: Optional[int] = None) -> Trajectory:
+    """Trajectory of the ball over num_frames frames, dt seconds apart"""
+    ball = Ball(seed)
+    trajectory = Trajectory(dt, seed)
+    for i in range(num_frames):
+        ball.step(dt)
+        trajectory.states.append(ball.state())
+    return trajectory
@@ -1,62 +1,331 @@
 #!/usr/bin/env python3
 """Output raw RGB frames to stdout for piping to mplayer/ffmpeg"""
 
+import argparse
 import math
 import time
 import sys
-import struct
-from raytracer import Vec3, Ray, Sphere, Plane, trace_ray
+import json
+import queue
+import threading
+from raytracer import Vec3, Ray, Sphere, Plane, Camera, trace_ray, enable_stats
+from physics import Ball, Trajectory, simulate
 
+# 'python': trace one pixel at a time with raytracer.trace_ray
+# 'numpy': trace the whole frame at once with raytracer_np (needs numpy)
+# 'parallel': trace bands of rows on all the cores with raytracer_mp
+# 'incremental': re-trace only the pixels around the ball with raytracer_inc
+# 'spy': render with the compiled raytracer.spy (build it with ./build-cffi.sh)
+BACKEND = 'python'
 
-def render_frame_rgb(width: int, height: int, ball_pos: Vec3) -> bytes:
-    """Render frame as raw RGB24 bytes"""
-    objects = [
+# Frames are written to the pipe by a separate thread, while the next ones
+# are rendered. QUEUE_DEPTH is the max number of frames waiting to be written;
+# when the pipe is slower than the renderer either wait for it
+# (DROP_FRAMES = False) or drop the oldest queued frame (DROP_FRAMES = True,
+# needs QUEUE_DEPTH >= 2).
+QUEUE_DEPTH = 2
+DROP_FRAMES = False
+
+# if True, the objects cast shadows: each hit traces a shadow ray towards the
+# light, see raytracer.occluded
+SHADOWS = False
+
+# if True, measure where the time goes (see raytracer.enable_stats) and print
+# it to stderr on exit; if STATS_JSON is set, also save it to that file
+STATS = False
+STATS_JSON = None
+
+# 'rgb24': raw RGB24 frames, 3 bytes per pixel; the player must be told the
+# size, frame rate and pixel format
+# 'y4m': a YUV4MPEG2 stream in YUV 4:2:0, 1.5 bytes per pixel, with a header
+# which describes it (see y4m.py, needs numpy); can be set with --format
+FORMAT = 'rgb24'
+
+# if set, render this many frames as fast as possible instead of running in
+# real time, e.g. to record a video: the physics advances by 1/FPS at each
+# frame, and the frames are rendered in batches of BATCH_SIZE (see
+# render_frames_rgb). SEED randomizes the launches of the ball (see physics.py)
+OFFLINE_FRAMES = None
+FPS = 30
+BATCH_SIZE = 50
+SEED = None
+
+# if set, render offline the frames of the trajectory of the ball saved in
+# this file (see physics.py); if RECORD is set, save the trajectory of the
+# ball to this file on exit
+REPLAY = None
+RECORD = None
+
+
+def make_objects(ball_pos: Vec3) -> list:
+    return [
         Sphere(ball_pos, 0.8, (1.0, 0.3, 0.3)),              # Bouncing red ball
         Sphere(Vec3(2.5, -0.3, -6), 1.0, (0.3, 0.3, 1.0)),   # Static blue sphere
         Plane(Vec3(0, -1.5, 0), Vec3(0, 1, 0), (0.7, 0.7, 0.7))  # Ground
     ]
 
+
+def render_frame_rgb(width: int, height: int, ball_pos: Vec3, camera: Camera,
+                     out: bytearray = None) -> bytes:
+    """
+    Render frame as raw RGB24 bytes. If `out` is given, the pixels are
+    written into it and it is returned.
+    """
+    if BACKEND == 'spy':
+        return render_frame_rgb_spy(width, height, ball_pos, camera, out)
+    elif BACKEND != 'python':
+        if BACKEND == 'numpy':
+            pixels = render_frame_rgb_numpy(width, height, ball_pos, camera)
+        elif BACKEND == 'parallel':
+            pixels = render_frame_rgb_parallel(width, height, ball_pos, camera)
+        elif BACKEND == 'incremental':
+            pixels = render_frame_rgb_incremental(width, height, ball_pos, camera)
+        else:
+            raise ValueError(f'unknown BACKEND: {BACKEND!r}')
+        if out is None:
+            return pixels
+        out[:] = pixels
+        return out
+
+    objects = make_objects(ball_pos)
+
+    light_dir = Vec3(0.5, 1, 0.3).normalize()
+
+    # Ray directions are cached by the camera across frames
+    dirs = camera.directions(width, height)
+
+    pixels = out if out is not None else bytearray(width * height * 3)
+
+    for i in range(0, width * height * 3, 3):
+        direction = Vec3(dirs[i], dirs[i + 1], dirs[i + 2])
+        ray = Ray(camera.pos, direction)
+
+        r, g, b = trace_ray(ray, objects, light_dir, SHADOWS)
+
+        # Convert to 8-bit RGB
+        pixels[i] = int(min(255, r * 255))
+        pixels[i + 1] = int(min(255, g * 255))
+        pixels[i + 2] = int(min(255, b * 255))
+
+    return pixels
+
+
+def render_frame_rgb_numpy(width: int, height: int, ball_pos: Vec3, camera: Camera) -> bytes:
+    """Same as render_frame_rgb, but trace all the rays at once with numpy"""
+    from raytracer_np import render_np
+    objects = make_objects(ball_pos)
+    light_dir = Vec3(0.5, 1, 0.3).normalize()
+    pixels = render_np(width, height, objects, light_dir, camera, SHADOWS)
+    return pixels.tobytes()
+
+
+def render_frame_rgb_parallel(width: int, height: int, ball_pos: Vec3,
+                              camera: Camera) -> memoryview:
+    """
+    Same as render_frame_rgb, but trace the rays on all the cores. The result
+    is a view on the shared framebuffer, valid until the next frame.
+    """
+    from raytracer_mp import default_renderer
+    objects = make_objects(ball_pos)
+    light_dir = Vec3(0.5, 1, 0.3).normalize()
+    return default_renderer().render(width, height, objects, light_dir, camera, SHADOWS)
+
+
+def render_frame_rgb_incremental(width: int, height: int, ball_pos: Vec3,
+                                 camera: Camera) -> bytearray:
+    """
+    Same as render_frame_rgb, but re-trace only the pixels which can change.
+    The result is reused for the next frame.
+    """
+    from raytracer_inc import default_renderer
+    objects = make_objects(ball_pos)
     light_dir = Vec3(0.5, 1, 0.3).normalize()
-    camera_pos = Vec3(0, 0, 0)
+    return default_renderer().render(width, height, objects, light_dir, camera, SHADOWS)
+
+
+def render_frame_rgb_spy(width: int, height: int, ball_pos: Vec3, camera: Camera,
+                         out: bytearray = None) -> bytearray:
+    """
+    Same as render_frame_rgb, but render with the compiled raytracer.spy,
+    directly into `out`. Only the field of view of the camera is used: it
+    must be at the origin.
+    """
+    from raytracer_spy import render_rgb
+    return render_rgb(width, height, ball_pos, camera, out, SHADOWS)
 
-    aspect_ratio = width / height
-    fov = math.pi / 3
 
-    pixels = []
+def render_frames_rgb(width: int, height: int, ball_positions: list,
+                      camera: Camera) -> bytes:
+    """
+    Render one frame per ball position, and return them as a single
+    contiguous RGB24 buffer, i.e. N * H * W * 3 bytes. The numpy and spy
+    backends render the whole batch with one call, setting up the scene and
+    the primary rays only once.
+    """
+    if BACKEND == 'spy':
+        from raytracer_spy import render_rgb_batch
+        return render_rgb_batch(width, height, ball_positions, camera, shadows=SHADOWS)
+    elif BACKEND == 'numpy':
+        from raytracer_np import render_np_batch
+        light_dir = Vec3(0.5, 1, 0.3).normalize()
+        scenes = [make_objects(ball_pos) for ball_pos in ball_positions]
+        return render_np_batch(width, height, scenes, light_dir, camera,
+                               shadows=SHADOWS).tobytes()
 
-    for y in range(height):
-        for x in range(width):
-            px = (2 * (x + 0.5) / width - 1) * aspect_ratio * math.tan(fov / 2)
-            py = (1 - 2 * (y + 0.5) / height) * math.tan(fov / 2)
+    frame_size = width * height * 3
+    frames = bytearray(len(ball_positions) * frame_size)
+    view = memoryview(frames)
+    for i, ball_pos in enumerate(ball_positions):
+        out = view[i * frame_size:(i + 1) * frame_size]
+        render_frame_rgb(width, height, ball_pos, camera, out)
+    return frames
 
-            direction = Vec3(px, py, -1).normalize()
-            ray = Ray(camera_pos, direction)
 
-            r, g, b = trace_ray(ray, objects, light_dir)
+class FrameWriter:
+    """
+    Write frames to a stream from a separate thread, so that writing one
+    frame overlaps with rendering the next one.
+
+    The frames live in a fixed set of preallocated buffers: get_buffer()
+    returns a free one to render into, and submit() queues it for writing;
+    the buffer becomes free again once it has been written.
+    """
+
+    def __init__(self, stream, frame_size: int, depth: int = 2,
+                 drop_frames: bool = False):
+        self.stream = stream
+        self.drop_frames = drop_frames
+        # one buffer being rendered, plus up to `depth` queued or being written
+        self.free = queue.Queue()
+        for i in range(depth + 1):
+            self.free.put(bytearray(frame_size))
+        self.ready = queue.Queue()
+        self.error = None
+        # statistics
+        self.written = 0
+        self.dropped = 0
+        self.wait_time = 0.0    # time the renderer waited for a free buffer
+        self.write_time = 0.0   # time the writer was blocked on the stream
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            buf = self.ready.get()
+            if buf is None:
+                break
+            if self.error is None:
+                start = time.perf_counter()
+                try:
+                    self.stream.write(buf)
+                    self.stream.flush()
+                    self.written += 1
+                except OSError as e:
+                    # e.g. BrokenPipeError: report it to the renderer
+                    self.error = e
+                self.write_time += time.perf_counter() - start
+            self.free.put(buf)
+
+    def get_buffer(self) -> bytearray:
+        """Return a buffer to render the next frame into"""
+        if self.error is not None:
+            raise self.error
+        try:
+            return self.free.get_nowait()
+        except queue.Empty:
+            pass
+        if self.drop_frames:
+            # the writer is behind: steal the oldest frame which is still
+            # waiting to be written
+            try:
+                buf = self.ready.get_nowait()
+            except queue.Empty:
+                pass
+            else:
+                self.dropped += 1
+                return buf
+        start = time.perf_counter()
+        buf = self.free.get()
+        self.wait_time += time.perf_counter() - start
+        return buf
 
-            # Convert to 8-bit RGB
-            r_int = int(min(255, r * 255))
-            g_int = int(min(255, g * 255))
-            b_int = int(min(255, b * 255))
+    def submit(self, buf: bytearray) -> None:
+        """Queue a frame returned by get_buffer() for writing"""
+        if self.error is not None:
+            self.free.put(buf)
+            raise self.error
+        self.ready.put(buf)
 
-            pixels.append(struct.pack('BBB', r_int, g_int, b_int))
+    def close(self) -> None:
+        """Write all the queued frames and stop the writer thread"""
+        self.ready.put(None)
+        self.thread.join()
 
-    return b''.join(pixels)
+
+def stream_header(width: int, height: int) -> bytes:
+    """What to write before the first frame, depending on FORMAT"""
+    if FORMAT == 'y4m':
+        import y4m
+        return y4m.header(width, height, FPS)
+    elif FORMAT != 'rgb24':
+        raise ValueError(f'unknown FORMAT: {FORMAT!r}')
+    return b''
+
+
+def output_frame_size(width: int, height: int) -> int:
+    """Bytes written to the pipe per frame, depending on FORMAT"""
+    if FORMAT == 'y4m':
+        import y4m
+        return y4m.frame_size(width, height)
+    return width * height * 3
+
+
+def render_offline(trajectory: Trajectory, width=320, height=240):
+    """Render one frame per state of the trajectory, and write them to stdout"""
+    camera = Camera(Vec3(0, 0, 0), math.pi / 3)
+    positions = [Vec3(x, y, z) for x, y, z in trajectory.positions()]
+    num_frames = len(positions)
+    out = sys.stdout.buffer
+    written = 0
+    start_time = time.perf_counter()
+    try:
+        out.write(stream_header(width, height))
+        for i in range(0, num_frames, BATCH_SIZE):
+            batch = positions[i:i + BATCH_SIZE]
+            frames = render_frames_rgb(width, height, batch, camera)
+            if FORMAT == 'y4m':
+                import y4m
+                frames = y4m.encode_frames(frames, width, height)
+            out.write(frames)
+            out.flush()
+            written += len(batch)
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    elapsed = time.perf_counter() - start_time
+    sys.stderr.write(f"Written {written} frames in {elapsed:.2f}s | "
+                     f"FPS: {written / elapsed:.1f} | {FORMAT}: "
+                     f"{output_frame_size(width, height) / 1024:.1f} KB/frame\n")
 
 
 def animate_to_stdout(width=320, height=240):
-    """Generate animation frames and write to stdout as raw RGB"""
+    """Generate animation frames and write them to stdout, in FORMAT"""
+
+    # The camera never moves: it caches the ray directions across frames
+    camera = Camera(Vec3(0, 0, 0), math.pi / 3)
 
-    # Physics parameters
-    gravity = 9.8
+    # the header is written before the writer thread starts
+    sys.stdout.buffer.write(stream_header(width, height))
+    writer = FrameWriter(sys.stdout.buffer, output_frame_size(width, height),
+                         QUEUE_DEPTH, DROP_FRAMES)
+    if FORMAT == 'y4m':
+        import y4m
+        # frames are rendered here, then converted into the writer's buffers
+        rgb = bytearray(width * height * 3)
 
-    # Ball initial position
-    x0, y0, z0 = -2.0, 2.0, -4.0
-    vx, vy, vz = 1.5, 0.0, 0.0
-    x, y, z = x0, y0, z0
+    stats = enable_stats() if STATS else None
 
-    ground_y = -1.5 + 0.8
-    damping = 0.7
+    ball = Ball(SEED)
+    recorded = Trajectory(None, SEED)
 
     frame_count = 0
     fps_update_interval = 10
@@ -72,40 +341,61 @@ def animate_to_stdout(width=320, height=240):
             last_frame_time = current_time
 
             # Update physics
-            vy -= gravity * dt
-            y += vy * dt
-            x += vx * dt
-            z += vz * dt
-
-            if y <= ground_y:
-                y = ground_y
-                vy = -vy * damping
-                if abs(vy) < 0.3:
-                    vy = 0
+            ball.step(dt)
+            recorded.states.append(ball.state())
 
             # Render and output frame
-            ball_pos = Vec3(x, y, z)
-            frame_data = render_frame_rgb(width, height, ball_pos)
-            sys.stdout.buffer.write(frame_data)
-            sys.stdout.buffer.flush()
+            ball_pos = Vec3(ball.x, ball.y, ball.z)
+            buf = writer.get_buffer()
+            t0 = time.perf_counter()
+            if FORMAT == 'y4m':
+                pixels = render_frame_rgb(width, height, ball_pos, camera, rgb)
+                if stats:
+                    stats.add_time('render (total)', time.perf_counter() - t0)
+                t0 = time.perf_counter()
+                y4m.encode_frames(pixels, width, height, buf)
+                if stats:
+                    stats.add_time('encode (y4m)', time.perf_counter() - t0)
+            else:
+                render_frame_rgb(width, height, ball_pos, camera, buf)
+                if stats:
+                    stats.add_time('render (total)', time.perf_counter() - t0)
+            writer.submit(buf)
 
             frame_count += 1
+            if stats:
+                stats.count('frames')
 
             # Update and report FPS
             if frame_count % fps_update_interval == 0:
                 elapsed = current_time - last_fps_time
                 fps = fps_update_interval / elapsed
                 last_fps_time = current_time
-                sys.stderr.write(f"Frame: {frame_count} | FPS: {fps:.1f}\n")
+                sys.stderr.write(f"Frame: {frame_count} | FPS: {fps:.1f} | "
+                                 f"dropped: {writer.dropped} | "
+                                 f"waiting for the pipe: {writer.wait_time:.2f}s\n")
                 sys.stderr.flush()
 
-            # Reset if ball goes too far
-            if x > 5:
-                x, y, z = x0, y0, z0
-                vx, vy, vz = 1.5, 0.0, 0.0
-
     except (KeyboardInterrupt, BrokenPipeError):
         sys.stderr.write(f"\nStopped after {frame_count} frames | Final FPS: {fps:.1f}\n")
+    finally:
+        writer.close()
+        sys.stderr.write(f"Written: {writer.written} | dropped: {writer.dropped} | "
+                         f"{FORMAT}: {output_frame_size(width, height) / 1024:.1f} KB/frame | "
+                         f"renderer waiting for the pipe: {writer.wait_time:.2f}s | "
+                         f"blocked writing: {writer.write_time:.2f}s\n")
+        if RECORD:
+            recorded.save(RECORD)
+            sys.stderr.write(f"Trajectory of {len(recorded)} frames saved to {RECORD}\n")
+        if stats:
+            # the writer thread runs concurrently: its time is not part of
+            # the time per frame
+            stats.add_time('output (writer thread)', writer.write_time)
+            stats.add_time('waiting for the pipe', writer.wait_time)
+            sys.stderr.write(stats.report() + '\n')
+            if STATS_JSON:
+                with open(STATS_JSON, 'w') as f:
+                    json.dump(stats.as_dict(), f, indent=2)
 
 
 if __name__ == '__main__':
@@ -113,4 +403,19 @@ if __name__ == '__main__':
     # mplayer: ./play.py | mplayer -demuxer rawvideo -rawvideo w=320:h=240:fps=30:format=rgb24 -
     # ffmpeg record: ./play.py | ffmpeg -f rawvideo -pixel_format rgb24 -video_size 320x240 -framerate 30 -i - output.mp4
     # ffmpeg play: ./play.py | ffplay -f rawvideo -pixel_format rgb24 -video_size 320x240 -framerate 30 -
-    animate_to_stdout(width=320, height=240)
+    # Y4M: ./play.py --format y4m | ffplay -
+    #      ./play.py --format y4m | ffmpeg -i - output.mp4
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--format', choices=['rgb24', 'y4m'], default=FORMAT,
+                        help='format of the frames written to stdout (default: %(default)s)')
+    FORMAT = parser.parse_args().format
+    if REPLAY or OFFLINE_FRAMES:
+        if REPLAY:
+            trajectory = Trajectory.load(REPLAY)
+        else:
+            trajectory = simulate(OFFLINE_FRAMES, 1 / FPS, SEED)
+        if RECORD:
+            trajectory.save(RECORD)
+        render_offline(trajectory, width=320, height=240)
+    else:
+        animate_to_stdout(width=320, height=240)
@@ -2,10 +2,17 @@
 """Simple ASCII raytracer with ANSI color support"""
 
 import os
+import sys
 import math
+import time
+from array import array
+from collections import defaultdict
+from contextlib import contextmanager
 from dataclasses import dataclass
 from typing import Optional, Tuple
 
+INF = float('inf')
+
 
 @dataclass
 class Vec3:
@@ -74,6 +81,27 @@ class Sphere:
         normal = (point - self.center).normalize()
         return HitRecord(point, normal, t, self.color)
 
+    def occludes(self, ray: Ray) -> bool:
+        """
+        Same as `intersect(ray) is not None`, which is all that shadow rays
+        need. It doesn't compute the hit point and the normal, and it works
+        on plain floats instead of temporary Vec3: the arithmetic is the same
+        as in intersect, in the same order, so the result is identical.
+        """
+        o = ray.origin
+        d = ray.direction
+        c = self.center
+        ocx = o.x - c.x
+        ocy = o.y - c.y
+        ocz = o.z - c.z
+        a = d.x * d.x + d.y * d.y + d.z * d.z
+        b = 2.0 * (ocx * d.x + ocy * d.y + ocz * d.z)
+        cc = (ocx * ocx + ocy * ocy + ocz * ocz) - self.radius * self.radius
+        discriminant = b * b - 4 * a * cc
+        if discriminant < 0:
+            return False
+        return (-b - math.sqrt(discriminant)) / (2.0 * a) >= 0.001
+
 
 class Plane:
     def __init__(self, point: Vec3, normal: Vec3, color: Tuple[float, float, float]):
@@ -100,24 +128,353 @@ class Plane:
 
         return HitRecord(point, self.normal, t, color)
 
+    def occludes(self, ray: Ray) -> bool:
+        """Same as `intersect(ray) is not None`, see Sphere.occludes"""
+        n = self.normal
+        d = ray.direction
+        denom = n.x * d.x + n.y * d.y + n.z * d.z
+        if abs(denom) < 0.0001:
+            return False
+        p = self.point
+        o = ray.origin
+        num = (p.x - o.x) * n.x + (p.y - o.y) * n.y + (p.z - o.z) * n.z
+        return num / denom >= 0.001
+
+
+class Camera:
+    """
+    Pinhole camera at `pos`, looking towards -z.
+
+    The normalized direction of the primary ray of each pixel depends only
+    on the resolution, the field of view and the pose of the camera, so it
+    is computed once and cached across frames. The cache is invalidated
+    automatically when any of them changes, e.g. when the terminal is
+    resized or the camera moves.
+    """
+
+    def __init__(self, pos: Vec3 = None, fov: float = math.pi / 3):
+        self.pos = pos if pos is not None else Vec3(0, 0, 0)
+        self.fov = fov
+        self._key = None
+        self._directions = None
+
+    def __getstate__(self):
+        # don't send the cache to other processes: it's cheaper to recompute
+        state = self.__dict__.copy()
+        state['_key'] = None
+        state['_directions'] = None
+        return state
+
+    def directions(self, width: int, height: int) -> array:
+        """
+        Flat array of 3 * width * height floats: the (x, y, z) direction of
+        each pixel, row by row.
+        """
+        key = (width, height, self.fov, self.pos.x, self.pos.y, self.pos.z)
+        if key != self._key:
+            self._directions = self._compute_directions(width, height)
+            self._key = key
+        return self._directions
+
+    def _compute_directions(self, width: int, height: int) -> array:
+        aspect_ratio = width / height
+        tan_half_fov = math.tan(self.fov / 2)
+        dirs = array('d', bytes(8 * 3 * width * height))
+        i = 0
+        for y in range(height):
+            py = (1 - 2 * (y + 0.5) / height) * tan_half_fov
+            for x in range(width):
+                px = (2 * (x + 0.5) / width - 1) * aspect_ratio * tan_half_fov
+                d = Vec3(px, py, -1).normalize()
+                dirs[i] = d.x
+                dirs[i + 1] = d.y
+                dirs[i + 2] = d.z
+                i += 3
+        return dirs
+
+
+class BVHNode:
+    def __init__(self, items):
+        # items is a list of (index, sphere): the index is the position of
+        # the sphere in the original list of objects
+        self.items = items
+        self.left = None
+        self.right = None
+        self.fit()
+
+    def is_leaf(self) -> bool:
+        return self.left is None
+
+    def fit(self) -> None:
+        """Recompute the bounding box of the node"""
+        if self.is_leaf():
+            spheres = [sphere for _, sphere in self.items]
+            # pad the box a bit, so that rounding errors never make us miss
+            # a sphere which the linear scan would hit
+            self.x0 = min(s.center.x - s.radius for s in spheres) - BVH.EPSILON
+            self.y0 = min(s.center.y - s.radius for s in spheres) - BVH.EPSILON
+            self.z0 = min(s.center.z - s.radius for s in spheres) - BVH.EPSILON
+            self.x1 = max(s.center.x + s.radius for s in spheres) + BVH.EPSILON
+            self.y1 = max(s.center.y + s.radius for s in spheres) + BVH.EPSILON
+            self.z1 = max(s.center.z + s.radius for s in spheres) + BVH.EPSILON
+        else:
+            l, r = self.left, self.right
+            self.x0, self.y0, self.z0 = min(l.x0, r.x0), min(l.y0, r.y0), min(l.z0, r.z0)
+            self.x1, self.y1, self.z1 = max(l.x1, r.x1), max(l.y1, r.y1), max(l.z1, r.z1)
+
+    def entry(self, ox: float, oy: float, oz: float,
+              ix: float, iy: float, iz: float) -> float:
+        """
+        Slab test: return the distance at which the ray enters the box, or
+        inf if it misses it. (ix, iy, iz) is the inverse of the direction.
+        """
+        tx0 = (self.x0 - ox) * ix
+        tx1 = (self.x1 - ox) * ix
+        if tx0 > tx1:
+            tx0, tx1 = tx1, tx0
+        ty0 = (self.y0 - oy) * iy
+        ty1 = (self.y1 - oy) * iy
+        if ty0 > ty1:
+            ty0, ty1 = ty1, ty0
+        tz0 = (self.z0 - oz) * iz
+        tz1 = (self.z1 - oz) * iz
+        if tz0 > tz1:
+            tz0, tz1 = tz1, tz0
+        t_enter = max(tx0, ty0, tz0)
+        t_exit = min(tx1, ty1, tz1)
+        if t_enter > t_exit or t_exit < 0.0:
+            return INF
+        return t_enter
+
+
+class BVH:
+    """
+    Bounding-volume hierarchy over the spheres of a scene.
+
+    Planes are unbounded, so they are kept in a separate list and tested
+    against every ray. A BVH can be passed to trace_ray in place of the list
+    of objects: the closest hit is the same as the one found by the linear
+    scan, including ties (the object which comes first wins).
+
+    If a sphere moves, call refit() to update the bounding boxes without
+    changing the tree, or rebuild() if the scene changed a lot.
+    """
+    EPSILON = 1e-7
+
+    def __init__(self, objects, leaf_size: int = 4):
+        self.objects = list(objects)
+        self.leaf_size = leaf_size
+        self.rebuild()
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __len__(self):
+        return len(self.objects)
+
+    def rebuild(self) -> None:
+        self.planes = []
+        spheres = []
+        for i, obj in enumerate(self.objects):
+            if isinstance(obj, Sphere):
+                spheres.append((i, obj))
+            else:
+                self.planes.append((i, obj))
+        self.root = self._build(spheres) if spheres else None
+
+    def _build(self, items) -> BVHNode:
+        node = BVHNode(items)
+        if len(items) <= self.leaf_size:
+            return node
+        # split at the median along the axis where the centers spread the most
+        xs = [s.center.x for _, s in items]
+        ys = [s.center.y for _, s in items]
+        zs = [s.center.z for _, s in items]
+        extents = [max(xs) - min(xs), max(ys) - min(ys), max(zs) - min(zs)]
+        axis = 'xyz'[extents.index(max(extents))]
+        items = sorted(items, key=lambda item: getattr(item[1].center, axis))
+        mid = len(items) // 2
+        node.items = None
+        node.left = self._build(items[:mid])
+        node.right = self._build(items[mid:])
+        node.fit()
+        return node
+
+    def refit(self) -> None:
+        """Update the bounding boxes after one or more spheres moved"""
+        if self.root is not None:
+            self._refit(self.root)
+
+    def _refit(self, node: BVHNode) -> None:
+        if not node.is_leaf():
+            self._refit(node.left)
+            self._refit(node.right)
+        node.fit()
 
-def trace_ray(ray: Ray, objects, light_dir: Vec3) -> Tuple[float, float, float]:
+    def intersect(self, ray: Ray) -> Optional[HitRecord]:
+        closest_hit = None
+        closest_t = float('inf')
+        closest_i = -1
+
+        for i, obj in self.planes:
+            hit = obj.intersect(ray)
+            if hit and (hit.t < closest_t or (hit.t == closest_t and i < closest_i)):
+                closest_hit = hit
+                closest_t = hit.t
+                closest_i = i
+
+        if self.root is None:
+            return closest_hit
+
+        o = ray.origin
+        d = ray.direction
+        # avoid divisions by zero: a huge number has the same effect as inf,
+        # without generating NaNs when multiplied by 0
+        ix = 1.0 / d.x if d.x != 0.0 else math.copysign(1e300, d.x)
+        iy = 1.0 / d.y if d.y != 0.0 else math.copysign(1e300, d.y)
+        iz = 1.0 / d.z if d.z != 0.0 else math.copysign(1e300, d.z)
+
+        # stack of (entry distance, node)
+        stack = [(self.root.entry(o.x, o.y, o.z, ix, iy, iz), self.root)]
+        while stack:
+            t_enter, node = stack.pop()
+            if t_enter == INF or t_enter > closest_t:
+                # the ray misses the box, or we already found something closer
+                continue
+            if node.is_leaf():
+                for i, sphere in node.items:
+                    hit = sphere.intersect(ray)
+                    if hit and (hit.t < closest_t or (hit.t == closest_t and i < closest_i)):
+                        closest_hit = hit
+                        closest_t = hit.t
+                        closest_i = i
+            else:
+                # push the farthest child first, so that we visit the nearest
+                # one first and have more chances to prune the other
+                t_left = node.left.entry(o.x, o.y, o.z, ix, iy, iz)
+                t_right = node.right.entry(o.x, o.y, o.z, ix, iy, iz)
+                if t_left <= t_right:
+                    stack.append((t_right, node.right))
+                    stack.append((t_left, node.left))
+                else:
+                    stack.append((t_left, node.left))
+                    stack.append((t_right, node.right))
+
+        return closest_hit
+
+    def occluded(self, ray: Ray) -> bool:
+        """Return True as soon as any object is hit, see raytracer.occluded"""
+        for _, obj in self.planes:
+            if obj.occludes(ray):
+                return True
+
+        if self.root is None:
+            return False
+
+        o = ray.origin
+        d = ray.direction
+        ix = 1.0 / d.x if d.x != 0.0 else math.copysign(1e300, d.x)
+        iy = 1.0 / d.y if d.y != 0.0 else math.copysign(1e300, d.y)
+        iz = 1.0 / d.z if d.z != 0.0 else math.copysign(1e300, d.z)
+
+        # any hit will do: no need to visit the nearest nodes first
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.entry(o.x, o.y, o.z, ix, iy, iz) == INF:
+                continue
+            if node.is_leaf():
+                for _, sphere in node.items:
+                    if sphere.occludes(ray):
+                        return True
+            else:
+                stack.append(node.right)
+                stack.append(node.left)
+        return False
+
+
+def occluded(ray: Ray, objects) -> bool:
+    """
+    Any-hit query: return True if any object intersects the ray. Unlike the
+    closest-hit search of trace_ray, it stops at the first object found,
+    and doesn't build any HitRecord.
+    """
+    if isinstance(objects, BVH):
+        return objects.occluded(ray)
+    for obj in objects:
+        if obj.occludes(ray):
+            return True
+    return False
+
+
+def in_shadow(hit: HitRecord, objects, light_dir: Vec3) -> bool:
+    """True if the light doesn't reach the point which was hit"""
+    # if the surface faces away from the light, the diffuse term is zero
+    # anyway: don't bother tracing the shadow ray
+    if hit.normal.dot(light_dir) <= 0.0:
+        return False
+    return occluded(Ray(hit.point, light_dir), objects)
+
+
+def trace_ray(ray: Ray, objects, light_dir: Vec3,
+              shadows: bool = False) -> Tuple[float, float, float]:
+    """
+    Color seen along the ray. If `shadows` is True, the objects cast
+    shadows: for each hit, a shadow ray is traced towards the light.
+    """
     closest_hit = None
     closest_t = float('inf')
 
-    for obj in objects:
+    if isinstance(objects, BVH):
+        closest_hit = objects.intersect(ray)
+    else:
+        for obj in objects:
+            hit = obj.intersect(ray)
+            if hit and hit.t < closest_t:
+                closest_hit = hit
+                closest_t = hit.t
+
+    if shadows and closest_hit is not None:
+        return shade(ray, closest_hit, light_dir,
+                     not in_shadow(closest_hit, objects, light_dir))
+    return shade(ray, closest_hit, light_dir)
+
+
+def trace_ray_id(ray: Ray, objects, light_dir: Vec3,
+                 shadows: bool = False) -> Tuple[Tuple[float, float, float], int]:
+    """
+    Same as trace_ray, but also return the index of the object which was
+    hit, or -1 for the sky.
+    """
+    closest_hit = None
+    closest_t = float('inf')
+    closest_i = -1
+
+    for i, obj in enumerate(objects):
         hit = obj.intersect(ray)
         if hit and hit.t < closest_t:
             closest_hit = hit
             closest_t = hit.t
+            closest_i = i
+
+    if shadows and closest_hit is not None:
+        lit = not in_shadow(closest_hit, objects, light_dir)
+        return shade(ray, closest_hit, light_dir, lit), closest_i
+    return shade(ray, closest_hit, light_dir), closest_i
 
+
+def shade(ray: Ray, closest_hit: Optional[HitRecord], light_dir: Vec3,
+          lit: bool = True) -> Tuple[float, float, float]:
     if closest_hit is None:
         # Sky gradient
         t = 0.5 * (ray.direction.y + 1.0)
         return (0.5 + 0.5*t, 0.7 + 0.3*t, 1.0)
 
-    # Simple diffuse lighting
-    light_intensity = max(0.0, closest_hit.normal.dot(light_dir))
+    # Simple diffuse lighting; in the shadow there is only the ambient light
+    if lit:
+        light_intensity = max(0.0, closest_hit.normal.dot(light_dir))
+    else:
+        light_intensity = 0.0
 
     # Ambient + diffuse
     ambient = 0.2
@@ -131,7 +488,167 @@ def trace_ray(ray: Ray, objects, light_dir: Vec3) -> Tuple[float, float, float]:
     return (r, g, b)
 
 
-def render(width: int, height: int):
+# ==== instrumentation ====
+
+class Stats:
+    """
+    Counters and cumulative time per stage, collected while enable_stats()
+    is active. Other code can add its own stages with timer() or add_time(),
+    e.g. the encoding of the frame.
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.times = defaultdict(float)
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] += n
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        self.times[stage] += seconds
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[stage] += time.perf_counter() - start
+
+    def reset(self) -> None:
+        self.counters.clear()
+        self.times.clear()
+
+    def as_dict(self) -> dict:
+        return {'counters': dict(self.counters), 'times': dict(self.times)}
+
+    def report(self) -> str:
+        lines = []
+        frames = self.counters.get('frames', 0)
+        rays = self.counters.get('rays', 0)
+        for stage, seconds in sorted(self.times.items(), key=lambda kv: -kv[1]):
+            line = f'{stage:>24}: {seconds:9.3f} s'
+            if frames:
+                line += f' {seconds / frames * 1000:9.2f} ms/frame'
+            lines.append(line)
+        for name, n in sorted(self.counters.items()):
+            line = f'{name:>24}: {n:>12,}'
+            if rays and name != 'rays' and name != 'frames':
+                line += f' {n / rays:9.2f} per ray'
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+# the active Stats, or None if the instrumentation is disabled
+stats = None
+_originals = {}
+
+
+def enable_stats() -> Stats:
+    """
+    Start collecting statistics and return the Stats which receives them.
+
+    The intersection, shadow, shading and ray generation functions are
+    replaced by instrumented wrappers until disable_stats() is called, so
+    that the instrumentation costs nothing when it's disabled. Only the scalar
+    tracer in this process is measured: not raytracer_np, and not the
+    workers of raytracer_mp.
+    """
+    global stats, shade, occluded
+    if stats is not None:
+        return stats
+    stats = Stats()
+    _originals['sphere'] = Sphere.intersect
+    _originals['plane'] = Plane.intersect
+    _originals['shade'] = shade
+    _originals['occluded'] = occluded
+    _originals['directions'] = Camera._compute_directions
+    Sphere.intersect = _instrument_intersect(Sphere.intersect, 'sphere', stats)
+    Plane.intersect = _instrument_intersect(Plane.intersect, 'plane', stats)
+    shade = _instrument_shade(shade, stats)
+    occluded = _instrument_occluded(occluded, stats)
+    Camera._compute_directions = _instrument_directions(Camera._compute_directions, stats)
+    return stats
+
+
+def disable_stats() -> Optional[Stats]:
+    """Restore the original functions, and return the collected Stats"""
+    global stats, shade, occluded
+    result = stats
+    if stats is not None:
+        Sphere.intersect = _originals['sphere']
+        Plane.intersect = _originals['plane']
+        shade = _originals['shade']
+        occluded = _originals['occluded']
+        Camera._compute_directions = _originals['directions']
+        stats = None
+    return result
+
+
+def _instrument_intersect(intersect, kind: str, stats: Stats):
+    counters = stats.counters
+    times = stats.times
+    tests = kind + ' tests'
+    hits = kind + ' hits'
+    perf_counter = time.perf_counter
+
+    def wrapper(self, ray: Ray) -> Optional[HitRecord]:
+        start = perf_counter()
+        hit = intersect(self, ray)
+        times['intersect'] += perf_counter() - start
+        counters[tests] += 1
+        if hit is not None:
+            counters[hits] += 1
+        return hit
+    return wrapper
+
+
+def _instrument_shade(shade, stats: Stats):
+    counters = stats.counters
+    times = stats.times
+    perf_counter = time.perf_counter
+
+    def wrapper(ray: Ray, closest_hit: Optional[HitRecord], light_dir: Vec3,
+                lit: bool = True) -> Tuple[float, float, float]:
+        start = perf_counter()
+        color = shade(ray, closest_hit, light_dir, lit)
+        times['shade'] += perf_counter() - start
+        counters['rays'] += 1
+        if closest_hit is None:
+            counters['sky misses'] += 1
+        return color
+    return wrapper
+
+
+def _instrument_occluded(occluded, stats: Stats):
+    counters = stats.counters
+    times = stats.times
+    perf_counter = time.perf_counter
+
+    def wrapper(ray: Ray, objects) -> bool:
+        start = perf_counter()
+        result = occluded(ray, objects)
+        times['shadow'] += perf_counter() - start
+        counters['shadow rays'] += 1
+        if result:
+            counters['shadowed'] += 1
+        return result
+    return wrapper
+
+
+def _instrument_directions(compute_directions, stats: Stats):
+    def wrapper(self, width: int, height: int) -> array:
+        with stats.timer('ray generation'):
+            return compute_directions(self, width, height)
+    return wrapper
+
+
+def render(width: int, height: int, half_blocks: bool = False):
+    """
+    Render the scene to the terminal, one pixel per cell of width x height.
+    With half_blocks=True, two pixels per cell: the image is 2 * height
+    pixels tall, see ansi.py.
+    """
     # Scene setup
     objects = [
         Sphere(Vec3(0, 0, -5), 1.5, (1.0, 0.3, 0.3)),        # Red sphere
@@ -143,9 +660,12 @@ def render(width: int, height: int):
     light_dir = Vec3(0.5, 1, 0.3).normalize()
     camera_pos = Vec3(0, 0, 0)
 
+    if half_blocks:
+        height *= 2
     aspect_ratio = width / height
     fov = math.pi / 3
 
+    pixels = bytearray()
     for y in range(height):
         for x in range(width):
             # Calculate ray direction
@@ -163,14 +683,23 @@ def render(width: int, height: int):
             g_int = int(min(255, g * 255))
             b_int = int(min(255, b * 255))
 
+            if half_blocks:
+                pixels += bytes((r_int, g_int, b_int))
+                continue
+
             # Use ANSI 24-bit color escape code to set background color
             print(f'\033[48;2;{r_int};{g_int};{b_int}m ', end='')
 
-        # Reset color at end of line
-        print('\033[0m')
+        if not half_blocks:
+            # Reset color at end of line
+            print('\033[0m')
+
+    if half_blocks:
+        from ansi import rgb_to_half_blocks
+        print(rgb_to_half_blocks(pixels, width, height), end='')
 
 
 if __name__ == '__main__':
     size = os.get_terminal_size()
     #render(120, 40)
-    render(size.columns, size.lines)
+    render(size.columns, size.lines, half_blocks='--half-blocks' in sys.argv)
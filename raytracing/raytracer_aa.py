@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Adaptive anti-aliasing for the raytracer.
+
+With one ray per pixel the silhouettes of the spheres and the horizon are
+jagged. Supersampling every pixel with N x N rays fixes that, but makes each
+frame N^2 times more expensive, while most pixels are in the middle of a
+flat area and wouldn't change at all. AdaptiveRenderer instead:
+
+  1. traces one ray per pixel, remembering which object it hit;
+
+  2. marks as edges the pixels which hit a different object than their
+     right or bottom neighbor, or whose color differs from it by more than
+     `threshold` (in 8-bit units, on any channel);
+
+  3. re-traces only the edge pixels with a grid of `samples` x `samples`
+     sub-pixel rays, and averages them.
+
+The extra rays are capped by `budget`, as a fraction of the primary rays: if
+there are more edge pixels than the budget allows, the ones with the
+highest contrast are supersampled first.
+"""
+
+import math
+import os
+from raytracer import Vec3, Ray, Sphere, Plane, Camera, trace_ray, trace_ray_id
+
+# two neighboring pixels whose colors differ by more than this on any
+# channel are an edge, even if they hit the same object
+COLOR_THRESHOLD = 48
+
+# hitting a different object is always an edge, and it takes precedence
+# over any color difference when the budget is tight
+OBJECT_EDGE = 256
+
+
+class AdaptiveRenderer:
+    """
+    Render anti-aliased frames as RGB24, supersampling only the edges.
+
+    After each call to render(), `rays` contains the number of rays which
+    were traced, and `edges` and `supersampled` the number of pixels which
+    were detected as edges and which were actually supersampled.
+    """
+
+    def __init__(self, samples: int = 2, threshold: int = COLOR_THRESHOLD,
+                 budget: float = 0.2):
+        self.samples = samples
+        self.threshold = threshold
+        self.budget = budget
+        self.rays = 0
+        self.edges = 0
+        self.supersampled = 0
+
+    def render(self, width: int, height: int, objects, light_dir: Vec3,
+               camera: Camera, shadows: bool = False) -> bytearray:
+        """Render a frame and return it as RGB24 bytes"""
+        pixels = bytearray(width * height * 3)
+        hit_ids = [0] * (width * height)
+
+        # 1. one ray per pixel
+        dirs = camera.directions(width, height)
+        for p in range(width * height):
+            i = p * 3
+            direction = Vec3(dirs[i], dirs[i + 1], dirs[i + 2])
+            ray = Ray(camera.pos, direction)
+
+            (r, g, b), hit_ids[p] = trace_ray_id(ray, objects, light_dir, shadows)
+
+            pixels[i] = int(min(255, r * 255))
+            pixels[i + 1] = int(min(255, g * 255))
+            pixels[i + 2] = int(min(255, b * 255))
+
+        # 2. find the edges, and supersample the sharpest ones first
+        edges = self._find_edges(width, height, pixels, hit_ids)
+        n_samples = self.samples * self.samples
+        max_pixels = int(width * height * self.budget) // n_samples
+        selected = sorted(edges, key=edges.get, reverse=True)[:max_pixels]
+
+        # 3. a grid of sub-pixel rays for each selected pixel
+        aspect_ratio = width / height
+        tan_half_fov = math.tan(camera.fov / 2)
+        offsets = [(k + 0.5) / self.samples for k in range(self.samples)]
+        for p in selected:
+            y, x = divmod(p, width)
+            r = g = b = 0.0
+            for fy in offsets:
+                py = (1 - 2 * (y + fy) / height) * tan_half_fov
+                for fx in offsets:
+                    px = (2 * (x + fx) / width - 1) * aspect_ratio * tan_half_fov
+                    ray = Ray(camera.pos, Vec3(px, py, -1).normalize())
+                    sr, sg, sb = trace_ray(ray, objects, light_dir, shadows)
+                    r += sr
+                    g += sg
+                    b += sb
+            i = p * 3
+            pixels[i] = int(min(255, r / n_samples * 255))
+            pixels[i + 1] = int(min(255, g / n_samples * 255))
+            pixels[i + 2] = int(min(255, b / n_samples * 255))
+
+        self.edges = len(edges)
+        self.supersampled = len(selected)
+        self.rays = width * height + len(selected) * n_samples
+        return pixels
+
+    def _find_edges(self, width: int, height: int, pixels: bytearray,
+                    hit_ids: list) -> dict:
+        """Map the index of each edge pixel to its contrast"""
+        threshold = self.threshold
+        edges = {}
+
+        def check(p: int, q: int) -> None:
+            if hit_ids[p] != hit_ids[q]:
+                contrast = OBJECT_EDGE
+            else:
+                i = p * 3
+                j = q * 3
+                contrast = max(abs(pixels[i] - pixels[j]),
+                               abs(pixels[i + 1] - pixels[j + 1]),
+                               abs(pixels[i + 2] - pixels[j + 2]))
+                if contrast <= threshold:
+                    return
+            # both sides of the edge are affected
+            if edges.get(p, -1) < contrast:
+                edges[p] = contrast
+            if edges.get(q, -1) < contrast:
+                edges[q] = contrast
+
+        for y in range(height):
+            row = y * width
+            for x in range(width):
+                p = row + x
+                if x + 1 < width:
+                    check(p, p + 1)
+                if y + 1 < height:
+                    check(p, p + width)
+        return edges
+
+
+_default_renderer = None
+
+
+def default_renderer() -> AdaptiveRenderer:
+    """Shared AdaptiveRenderer, with the default settings"""
+    global _default_renderer
+    if _default_renderer is None:
+        _default_renderer = AdaptiveRenderer()
+    return _default_renderer
+
+
+def render(width: int, height: int):
+    # Same scene as raytracer.render
+    objects = [
+        Sphere(Vec3(0, 0, -5), 1.5, (1.0, 0.3, 0.3)),        # Red sphere
+        Sphere(Vec3(-2, -0.5, -4), 0.8, (0.3, 1.0, 0.3)),    # Green sphere
+        Sphere(Vec3(2.5, -0.3, -6), 1.0, (0.3, 0.3, 1.0)),   # Blue sphere
+        Plane(Vec3(0, -1.5, 0), Vec3(0, 1, 0), (0.7, 0.7, 0.7))  # Ground
+    ]
+    light_dir = Vec3(0.5, 1, 0.3).normalize()
+    camera = Camera(Vec3(0, 0, 0), math.pi / 3)
+
+    renderer = AdaptiveRenderer()
+    pixels = renderer.render(width, height, objects, light_dir, camera)
+    for y in range(height):
+        row = pixels[y * width * 3:(y + 1) * width * 3]
+        line = ''.join(f'\033[48;2;{row[i]};{row[i+1]};{row[i+2]}m '
+                       for i in range(0, len(row), 3))
+        print(line + '\033[0m')
+    primary = width * height
+    print(f"{renderer.rays} rays ({renderer.rays / primary - 1:+.0%}), "
+          f"{renderer.supersampled}/{renderer.edges} edge pixels supersampled",
+          end='')
+
+
+if __name__ == '__main__':
+    size = os.get_terminal_size()
+    # keep the last line for the number of rays
+    render(size.columns, size.lines - 1)
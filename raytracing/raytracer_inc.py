@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""Incremental version of the raytracer, for animated scenes.
+
+In the bouncing ball animation only the ball moves, but a full render
+re-traces every pixel, including the static sphere, the ground and the sky.
+IncrementalRenderer keeps the previous frame together with the index of the
+object hit by each pixel, and compares the scene with the one of the
+previous frame. If only some spheres moved, it re-traces only:
+
+  - the pixels inside the screen-space bounding box of their new position,
+    because they might hit them now;
+
+  - the pixels which hit them in the previous frame.
+
+Every other pixel hits the same object as before, at the same point, so its
+color cannot change: the result is identical to a full re-render.
+Everything else (a plane, the camera, the light or the resolution) is
+considered a global change, and triggers a full render. So does any change
+when the objects cast shadows: the shadow of a sphere can fall anywhere.
+"""
+
+import math
+from array import array
+from typing import Optional, Tuple
+from raytracer import Vec3, Ray, Sphere, Plane, Camera, trace_ray_id
+
+
+def describe(obj) -> tuple:
+    """Snapshot of everything which can influence the color of an object"""
+    if isinstance(obj, Sphere):
+        c = obj.center
+        return ('sphere', c.x, c.y, c.z, obj.radius, obj.color)
+    elif isinstance(obj, Plane):
+        p = obj.point
+        n = obj.normal
+        return ('plane', p.x, p.y, p.z, n.x, n.y, n.z, obj.color)
+    raise TypeError(f'unsupported object: {obj!r}')
+
+
+def sphere_screen_rect(center: Vec3, radius: float, camera: Camera, width: int,
+                       height: int) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Conservative bounding rectangle (x0, y0, x1, y1) of the pixels whose
+    primary ray can hit the sphere; x1 and y1 are exclusive. Return None if
+    no pixel can hit it.
+    """
+    # be generous, so that rounding errors never make us miss a pixel
+    r = radius * 1.0001 + 1e-9
+    a = center.x - camera.pos.x
+    b = center.y - camera.pos.y
+    depth = camera.pos.z - center.z   # the camera looks towards -z
+    if depth + r < 0:
+        # entirely behind the camera
+        return None
+    if depth <= r:
+        # the sphere contains the camera or crosses its plane: its
+        # projection is unbounded
+        return (0, 0, width, height)
+
+    # The primary ray of a pixel is (px, py, -1). In the xz plane the sphere
+    # is a disk, and the lines through the camera which are tangent to it
+    # have slopes u = (a*depth +- r*sqrt(a^2 + depth^2 - r^2)) / (depth^2 - r^2).
+    # A ray can hit the sphere only if px is between them; same for py.
+    def slopes(a: float) -> Tuple[float, float]:
+        k = depth * depth - r * r
+        s = r * math.sqrt(a * a + depth * depth - r * r)
+        return (a * depth - s) / k, (a * depth + s) / k
+
+    aspect_ratio = width / height
+    tan_half_fov = math.tan(camera.fov / 2)
+    u_min, u_max = slopes(a)
+    v_min, v_max = slopes(b)
+
+    # invert px = (2 * (x + 0.5) / width - 1) * aspect_ratio * tan_half_fov
+    x_min = (u_min / (aspect_ratio * tan_half_fov) + 1) * width / 2 - 0.5
+    x_max = (u_max / (aspect_ratio * tan_half_fov) + 1) * width / 2 - 0.5
+    # invert py = (1 - 2 * (y + 0.5) / height) * tan_half_fov (y grows downwards)
+    y_min = (1 - v_max / tan_half_fov) * height / 2 - 0.5
+    y_max = (1 - v_min / tan_half_fov) * height / 2 - 0.5
+
+    x0 = max(0, math.floor(x_min) - 1)
+    x1 = min(width, math.ceil(x_max) + 2)
+    y0 = max(0, math.floor(y_min) - 1)
+    y1 = min(height, math.ceil(y_max) + 2)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return (x0, y0, x1, y1)
+
+
+class IncrementalRenderer:
+    """
+    Render frames as RGB24, re-tracing only the pixels which can have
+    changed since the previous frame.
+
+    After each call to render(), `traced` contains the number of rays which
+    were actually traced.
+    """
+
+    def __init__(self):
+        self.pixels = None     # bytearray, RGB24
+        self.hit_ids = None    # array('i'), index of the object hit, -1 for the sky
+        self.key = None        # everything which triggers a full render
+        self.snapshot = None   # describe() of each object of the previous frame
+        self.traced = 0
+
+    def render(self, width: int, height: int, objects, light_dir: Vec3,
+               camera: Camera, shadows: bool = False) -> bytearray:
+        """
+        Render a frame and return it as RGB24 bytes. The returned bytearray
+        is reused for the next frame.
+        """
+        key = (width, height, camera.fov, camera.pos.x, camera.pos.y,
+               camera.pos.z, light_dir.x, light_dir.y, light_dir.z, len(objects),
+               shadows)
+        snapshot = [describe(obj) for obj in objects]
+
+        changed = None
+        if key == self.key:
+            changed = [i for i, (old, new) in enumerate(zip(self.snapshot, snapshot))
+                       if old != new]
+            if any(snapshot[i][0] != 'sphere' or self.snapshot[i][0] != 'sphere'
+                   for i in changed):
+                changed = None
+            elif shadows and changed:
+                changed = None
+
+        if changed is None:
+            dirty = range(width * height)
+        else:
+            dirty = self._dirty_pixels(width, height, objects, camera, changed)
+
+        if self.key != key:
+            self.pixels = bytearray(width * height * 3)
+            self.hit_ids = array('i', bytes(4 * width * height))
+        self.key = key
+        self.snapshot = snapshot
+
+        pixels = self.pixels
+        hit_ids = self.hit_ids
+        dirs = camera.directions(width, height)
+        for p in dirty:
+            i = p * 3
+            direction = Vec3(dirs[i], dirs[i + 1], dirs[i + 2])
+            ray = Ray(camera.pos, direction)
+
+            (r, g, b), hit_id = trace_ray_id(ray, objects, light_dir, shadows)
+
+            pixels[i] = int(min(255, r * 255))
+            pixels[i + 1] = int(min(255, g * 255))
+            pixels[i + 2] = int(min(255, b * 255))
+            hit_ids[p] = hit_id
+        self.traced = len(dirty)
+        return pixels
+
+    def _dirty_pixels(self, width: int, height: int, objects, camera: Camera,
+                      changed: list) -> list:
+        """Indices of the pixels which must be re-traced"""
+        mask = bytearray(width * height)
+        for k in changed:
+            # pixels which can hit the sphere in its new position
+            sphere = objects[k]
+            rect = sphere_screen_rect(sphere.center, sphere.radius, camera,
+                                      width, height)
+            if rect is not None:
+                x0, y0, x1, y1 = rect
+                for y in range(y0, y1):
+                    mask[y * width + x0:y * width + x1] = b'\x01' * (x1 - x0)
+
+            # pixels which hit it in the previous frame: they are all inside
+            # the rectangle of the old position
+            _, cx, cy, cz, radius, _ = self.snapshot[k]
+            rect = sphere_screen_rect(Vec3(cx, cy, cz), radius, camera,
+                                      width, height)
+            if rect is not None:
+                x0, y0, x1, y1 = rect
+                hit_ids = self.hit_ids
+                for y in range(y0, y1):
+                    for p in range(y * width + x0, y * width + x1):
+                        if hit_ids[p] == k:
+                            mask[p] = 1
+
+        return [p for p, flag in enumerate(mask) if flag]
+
+
+_default_renderer = None
+
+
+def default_renderer() -> IncrementalRenderer:
+    """Shared IncrementalRenderer, which keeps the frame across calls"""
+    global _default_renderer
+    if _default_renderer is None:
+        _default_renderer = IncrementalRenderer()
+    return _default_renderer
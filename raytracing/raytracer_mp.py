@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""Multi-process version of the raytracer.
+
+Every pixel is independent, so the frame is split into bands of rows which
+are traced by a persistent pool of worker processes. The workers write their
+pixels directly into a shared-memory RGB24 framebuffer, so the only things
+which cross the process boundary are the scene description and the band
+coordinates. Each band is traced with the same code as the serial path, so
+the result is identical.
+"""
+
+import atexit
+import math
+import os
+from multiprocessing import Pool
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from raytracer import Vec3, Ray, Camera, trace_ray
+
+
+def render_rows(width: int, height: int, y0: int, y1: int, objects,
+                light_dir: Vec3, camera: Camera, shadows: bool = False) -> bytearray:
+    """Render rows [y0, y1) of the frame as RGB24 bytes"""
+    dirs = camera.directions(width, height)
+    out = bytearray(width * (y1 - y0) * 3)
+    i = 0
+    for j in range(y0 * width * 3, y1 * width * 3, 3):
+        direction = Vec3(dirs[j], dirs[j + 1], dirs[j + 2])
+        ray = Ray(camera.pos, direction)
+
+        r, g, b = trace_ray(ray, objects, light_dir, shadows)
+
+        out[i] = int(min(255, r * 255))
+        out[i + 1] = int(min(255, g * 255))
+        out[i + 2] = int(min(255, b * 255))
+        i += 3
+    return out
+
+
+# ==== worker side ====
+
+# the framebuffer which the worker is currently attached to
+_worker_shm = None
+
+# the camera is pickled without its cache of ray directions: keep the last
+# one we received, so that we can reuse its cache across frames
+_worker_camera = None
+
+
+def _attach(name: str) -> SharedMemory:
+    global _worker_shm
+    if _worker_shm is None or _worker_shm.name != name:
+        if _worker_shm is not None:
+            _worker_shm.close()
+        _worker_shm = SharedMemory(name)
+    return _worker_shm
+
+
+def _cached_camera(camera: Camera) -> Camera:
+    global _worker_camera
+    if (_worker_camera is None or _worker_camera.fov != camera.fov or
+        _worker_camera.pos != camera.pos):
+        _worker_camera = camera
+    return _worker_camera
+
+
+def _render_band(shm_name: str, width: int, height: int, y0: int, y1: int,
+                 objects, light_dir: Vec3, camera: Camera, shadows: bool) -> None:
+    shm = _attach(shm_name)
+    camera = _cached_camera(camera)
+    band = render_rows(width, height, y0, y1, objects, light_dir, camera, shadows)
+    start = y0 * width * 3
+    shm.buf[start:start + len(band)] = band
+
+
+# ==== parent side ====
+
+class ParallelRenderer:
+    """
+    Render frames on a persistent pool of worker processes.
+
+    The frame is split into `workers * bands_per_worker` bands of rows: having
+    more bands than workers keeps all of them busy even if some bands (e.g.
+    the ones containing spheres) are more expensive than others.
+    """
+
+    def __init__(self, workers: int = None, bands_per_worker: int = 4):
+        self.workers = workers or os.cpu_count()
+        self.bands_per_worker = bands_per_worker
+        # make sure that the workers share the resource tracker of the
+        # parent: else each of them would start its own, which would unlink
+        # the framebuffer as soon as the worker exits
+        resource_tracker.ensure_running()
+        self.pool = Pool(self.workers)
+        self.shm = None
+        self.view = None
+
+    def _framebuffer(self, size: int) -> SharedMemory:
+        if self.shm is None or self.shm.size < size:
+            # first frame, or the terminal became bigger
+            self._free_framebuffer()
+            self.shm = SharedMemory(create=True, size=size)
+        return self.shm
+
+    def _free_framebuffer(self) -> None:
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def render(self, width: int, height: int, objects, light_dir: Vec3,
+               camera: Camera, shadows: bool = False) -> memoryview:
+        """
+        Render a frame and return it as RGB24 bytes.
+
+        The returned memoryview points directly to the shared framebuffer, so
+        it is valid only until the next call to render() or close().
+        """
+        size = width * height * 3
+        shm = self._framebuffer(size)
+
+        n_bands = min(height, self.workers * self.bands_per_worker)
+        tasks = []
+        for i in range(n_bands):
+            y0 = height * i // n_bands
+            y1 = height * (i + 1) // n_bands
+            tasks.append((shm.name, width, height, y0, y1,
+                          objects, light_dir, camera, shadows))
+        self.pool.starmap(_render_band, tasks)
+
+        if self.view is not None:
+            self.view.release()
+        self.view = shm.buf[:size]
+        return self.view
+
+    def close(self) -> None:
+        self.pool.close()
+        self.pool.join()
+        self._free_framebuffer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_default_renderer = None
+
+
+def default_renderer() -> ParallelRenderer:
+    """Shared ParallelRenderer using all the available cores"""
+    global _default_renderer
+    if _default_renderer is None:
+        _default_renderer = ParallelRenderer()
+        atexit.register(_default_renderer.close)
+    return _default_renderer
+
+
+if __name__ == '__main__':
+    from raytracer import Sphere, Plane
+    size = os.get_terminal_size()
+    width, height = size.columns, size.lines
+    objects = [
+        Sphere(Vec3(0, 0, -5), 1.5, (1.0, 0.3, 0.3)),        # Red sphere
+        Sphere(Vec3(-2, -0.5, -4), 0.8, (0.3, 1.0, 0.3)),    # Green sphere
+        Sphere(Vec3(2.5, -0.3, -6), 1.0, (0.3, 0.3, 1.0)),   # Blue sphere
+        Plane(Vec3(0, -1.5, 0), Vec3(0, 1, 0), (0.7, 0.7, 0.7))  # Ground
+    ]
+    light_dir = Vec3(0.5, 1, 0.3).normalize()
+    with ParallelRenderer() as renderer:
+        camera = Camera(Vec3(0, 0, 0), math.pi / 3)
+        buf = bytes(renderer.render(width, height, objects, light_dir, camera))
+    for y in range(height):
+        row = buf[y * width * 3:(y + 1) * width * 3]
+        line = ''.join(f'\033[48;2;{row[i]};{row[i+1]};{row[i+2]}m '
+                       for i in range(0, len(row), 3))
+        print(line + '\033[0m')
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""Vectorized NumPy version of the raytracer.
+
+Instead of tracing one Ray at a time, all the primary rays of a frame are
+generated at once as (H, W, 3) arrays and intersected against each object
+with array math. The arithmetic is done in exactly the same order as in
+raytracer.py, so the result is identical to trace_ray pixel for pixel.
+"""
+
+import os
+import math
+import numpy as np
+from raytracer import Vec3, Sphere, Plane, Camera
+
+
+def primary_directions(camera: Camera, width: int, height: int) -> np.ndarray:
+    """
+    Normalized direction of the primary ray of every pixel, shape (H, W, 3).
+    This is a view on the directions cached by the camera, don't modify it.
+    """
+    dirs = np.frombuffer(camera.directions(width, height), dtype=np.float64)
+    return dirs.reshape(height, width, 3)
+
+
+def intersect_sphere(sphere: Sphere, origin, dx, dy, dz) -> np.ndarray:
+    """Distance to the sphere along each ray, np.inf where the ray misses it"""
+    c = sphere.center
+    ocx = origin[0] - c.x
+    ocy = origin[1] - c.y
+    ocz = origin[2] - c.z
+    a = dx * dx + dy * dy + dz * dz
+    b = 2.0 * (ocx * dx + ocy * dy + ocz * dz)
+    cc = (ocx * ocx + ocy * ocy + ocz * ocz) - sphere.radius * sphere.radius
+    discriminant = b * b - 4 * a * cc
+
+    with np.errstate(invalid='ignore'):
+        t = (-b - np.sqrt(discriminant)) / (2.0 * a)
+    miss = (discriminant < 0) | (t < 0.001)
+    t[miss] = np.inf
+    return t
+
+
+def intersect_plane(plane: Plane, origin, dx, dy, dz) -> np.ndarray:
+    """Distance to the plane along each ray, np.inf where the ray misses it"""
+    n = plane.normal
+    p = plane.point
+    denom = n.x * dx + n.y * dy + n.z * dz
+    num = ((p.x - origin[0]) * n.x +
+           (p.y - origin[1]) * n.y +
+           (p.z - origin[2]) * n.z)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = num / denom
+    miss = (np.abs(denom) < 0.0001) | (t < 0.001)
+    t = np.where(miss, np.inf, t)
+    return t
+
+
+def intersect(obj, origin, dx, dy, dz) -> np.ndarray:
+    if isinstance(obj, Sphere):
+        return intersect_sphere(obj, origin, dx, dy, dz)
+    elif isinstance(obj, Plane):
+        return intersect_plane(obj, origin, dx, dy, dz)
+    raise TypeError(f'unsupported object: {obj!r}')
+
+
+def closest_hit(origin, dirs: np.ndarray, objects):
+    """
+    Return (closest_t, obj_index) for every ray. obj_index is -1 where the
+    ray doesn't hit anything.
+    """
+    dx = dirs[..., 0]
+    dy = dirs[..., 1]
+    dz = dirs[..., 2]
+    closest_t = np.full(dirs.shape[:-1], np.inf)
+    obj_index = np.full(dirs.shape[:-1], -1, dtype=np.int32)
+    for i, obj in enumerate(objects):
+        t = intersect(obj, origin, dx, dy, dz)
+        # strict '<' so that on ties the first object wins, like trace_ray
+        hit = t < closest_t
+        closest_t[hit] = t[hit]
+        obj_index[hit] = i
+    return closest_t, obj_index
+
+
+def occluded(points, objects, light_dir: Vec3) -> np.ndarray:
+    """
+    Vectorized equivalent of raytracer.occluded, for the shadow rays which
+    start at `points` (a tuple of x, y, z arrays) towards the light.
+    """
+    blocked = np.zeros(points[0].shape, dtype=bool)
+    for obj in objects:
+        blocked |= intersect(obj, points, light_dir.x, light_dir.y, light_dir.z) < np.inf
+    return blocked
+
+
+def shade(origin, dirs: np.ndarray, objects, light_dir: Vec3,
+          closest_t: np.ndarray, obj_index: np.ndarray,
+          shadows: bool = False) -> np.ndarray:
+    """Compute the float RGB color of every ray, given its closest hit"""
+    colors = np.empty(dirs.shape)
+    ambient = 0.2
+
+    # Sky gradient
+    miss = obj_index == -1
+    t = 0.5 * (dirs[miss, 1] + 1.0)
+    colors[miss, 0] = 0.5 + 0.5 * t
+    colors[miss, 1] = 0.7 + 0.3 * t
+    colors[miss, 2] = 1.0
+
+    for i, obj in enumerate(objects):
+        mask = obj_index == i
+        if not mask.any():
+            continue
+        d = dirs[mask]
+        t = closest_t[mask]
+        ox = origin[0] if np.isscalar(origin[0]) else origin[0][mask]
+        oy = origin[1] if np.isscalar(origin[1]) else origin[1][mask]
+        oz = origin[2] if np.isscalar(origin[2]) else origin[2][mask]
+        px = ox + d[:, 0] * t
+        py = oy + d[:, 1] * t
+        pz = oz + d[:, 2] * t
+
+        if isinstance(obj, Sphere):
+            c = obj.center
+            nx = px - c.x
+            ny = py - c.y
+            nz = pz - c.z
+            l = np.sqrt(nx * nx + ny * ny + nz * nz)
+            nx = nx / l
+            ny = ny / l
+            nz = nz / l
+            light_intensity = np.maximum(
+                0.0, nx * light_dir.x + ny * light_dir.y + nz * light_dir.z)
+            base = np.empty((len(t), 3))
+            base[:] = obj.color
+        else:
+            n = obj.normal
+            light_intensity = max(
+                0.0, n.x * light_dir.x + n.y * light_dir.y + n.z * light_dir.z)
+            light_intensity = np.full(len(t), light_intensity)
+            # Checkerboard pattern
+            checker_size = 2.0
+            cx = np.trunc(px / checker_size).astype(np.int64)
+            cz = np.trunc(pz / checker_size).astype(np.int64)
+            base = np.empty((len(t), 3))
+            base[:] = obj.color
+            base[(cx + cz) % 2 == 0] = (0.9, 0.9, 0.9)
+
+        if shadows:
+            # like raytracer.in_shadow, trace shadow rays only for the points
+            # which face the light
+            lit = light_intensity > 0.0
+            shadowed = occluded((px[lit], py[lit], pz[lit]), objects, light_dir)
+            light_intensity[np.flatnonzero(lit)[shadowed]] = 0.0
+
+        # Ambient + diffuse
+        total_intensity = ambient + (1.0 - ambient) * light_intensity
+        colors[mask] = base * total_intensity[:, np.newaxis]
+
+    return colors
+
+
+def trace_rays(origin, dirs: np.ndarray, objects, light_dir: Vec3,
+               shadows: bool = False) -> np.ndarray:
+    """Vectorized equivalent of trace_ray: dirs is (..., 3), returns (..., 3) colors"""
+    closest_t, obj_index = closest_hit(origin, dirs, objects)
+    return shade(origin, dirs, objects, light_dir, closest_t, obj_index, shadows)
+
+
+def to_rgb8(colors: np.ndarray) -> np.ndarray:
+    """Convert float colors to 8-bit, like int(min(255, c * 255))"""
+    return np.minimum(255, colors * 255).astype(np.uint8)
+
+
+def render_np(width: int, height: int, objects, light_dir: Vec3,
+              camera: Camera, shadows: bool = False) -> np.ndarray:
+    """Render a frame and return a (H, W, 3) uint8 RGB framebuffer"""
+    dirs = primary_directions(camera, width, height)
+    origin = (camera.pos.x, camera.pos.y, camera.pos.z)
+    return to_rgb8(trace_rays(origin, dirs, objects, light_dir, shadows))
+
+
+def render_np_batch(width: int, height: int, scenes: list, light_dir: Vec3,
+                    camera: Camera, out: np.ndarray = None,
+                    shadows: bool = False) -> np.ndarray:
+    """
+    Render one frame per list of objects in `scenes`, and return them as a
+    contiguous (N, H, W, 3) uint8 array. The primary rays are set up once for
+    the whole batch.
+    """
+    if out is None:
+        out = np.empty((len(scenes), height, width, 3), dtype=np.uint8)
+    dirs = primary_directions(camera, width, height)
+    origin = (camera.pos.x, camera.pos.y, camera.pos.z)
+    for frame, objects in zip(out, scenes):
+        frame[...] = to_rgb8(trace_rays(origin, dirs, objects, light_dir, shadows))
+    return out
+
+
+def render(width: int, height: int):
+    # Same scene as raytracer.render
+    objects = [
+        Sphere(Vec3(0, 0, -5), 1.5, (1.0, 0.3, 0.3)),        # Red sphere
+        Sphere(Vec3(-2, -0.5, -4), 0.8, (0.3, 1.0, 0.3)),    # Green sphere
+        Sphere(Vec3(2.5, -0.3, -6), 1.0, (0.3, 0.3, 1.0)),   # Blue sphere
+        Plane(Vec3(0, -1.5, 0), Vec3(0, 1, 0), (0.7, 0.7, 0.7))  # Ground
+    ]
+    light_dir = Vec3(0.5, 1, 0.3).normalize()
+    camera = Camera(Vec3(0, 0, 0), math.pi / 3)
+
+    pixels = render_np(width, height, objects, light_dir, camera)
+    for row in pixels.tolist():
+        line = ''.join(f'\033[48;2;{r};{g};{b}m ' for r, g, b in row)
+        print(line + '\033[0m')
+
+
+if __name__ == '__main__':
+    size = os.get_terminal_size()
+    render(size.columns, size.lines)
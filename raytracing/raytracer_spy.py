@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Python wrappers around the compiled raytracer.spy.
+
+The extension module `_raytracer_spy` is built by ./build-cffi.sh, see
+cffi_build.py. It renders the bouncing ball scene of demo.py, with the camera
+at the origin: only its field of view can be chosen, and a camera anywhere
+else is rejected.
+
+render_objects_rgb() renders any list of spheres and planes instead, with the
+same signature as the other renderers (see benchsuite.py).
+
+Every call crosses the FFI boundary and sets up the scene and the primary
+rays again. When the ball positions of several frames are known in advance
+(offline rendering, benchmarks), render_rgb_batch() renders all of them with
+a single call, which does that work only once.
+"""
+
+from array import array
+from raytracer import Vec3, Camera, Sphere
+from _raytracer_spy import ffi, lib
+
+
+def check_camera(camera: Camera) -> None:
+    """The SPy scene always has the camera at the origin"""
+    pos = camera.pos
+    if (pos.x, pos.y, pos.z) != (0, 0, 0):
+        raise ValueError(f'the spy backend only supports a camera at the origin, '
+                         f'not at {pos}')
+
+
+def check_buffer(out, size: int) -> None:
+    """
+    out must be a writable, C-contiguous buffer of at least `size` bytes,
+    e.g. a bytearray or a uint8 numpy array of any shape
+    """
+    view = memoryview(out)
+    if view.readonly or not view.c_contiguous or view.format != 'B':
+        raise ValueError('the output buffer must be a writable, contiguous '
+                         'buffer of bytes (e.g. a uint8 array)')
+    if view.nbytes < size:
+        raise ValueError(f'the output buffer is too small: {view.nbytes} bytes '
+                         f'instead of {size}')
+
+
+def render_rgb(width: int, height: int, ball_pos: Vec3, camera: Camera,
+               out: bytearray = None, shadows: bool = False) -> bytearray:
+    """Render a frame as RGB24 bytes, into `out` if given"""
+    check_camera(camera)
+    if out is None:
+        out = bytearray(width * height * 3)
+    else:
+        check_buffer(out, width * height * 3)
+    lib.render_rgb(ffi.from_buffer(out), width, height, camera.fov,
+                   ball_pos.x, ball_pos.y, ball_pos.z, shadows)
+    return out
+
+
+def render_rgb_batch(width: int, height: int, ball_positions: list, camera: Camera,
+                     out: bytearray = None, shadows: bool = False) -> bytearray:
+    """
+    Render one frame per ball position, and return them as a contiguous
+    (N, H, W, 3) RGB24 buffer, i.e. the frames one after the other. If `out`
+    is given, it must be big enough for all of them.
+    """
+    check_camera(camera)
+    n = len(ball_positions)
+    if out is None:
+        out = bytearray(n * width * height * 3)
+    else:
+        check_buffer(out, n * width * height * 3)
+    balls = array('d')
+    for pos in ball_positions:
+        balls.extend((pos.x, pos.y, pos.z))
+    if n:
+        lib.render_rgb_batch(ffi.from_buffer(out), n, width, height, camera.fov,
+                             ffi.from_buffer('double[]', balls), shadows)
+    return out
+
+
+def render_objects_rgb(width: int, height: int, objects: list, light_dir: Vec3,
+                       camera: Camera, shadows: bool = False,
+                       out: bytearray = None) -> bytearray:
+    """Render a list of Sphere and Plane objects as RGB24 bytes"""
+    check_camera(camera)
+    if out is None:
+        out = bytearray(width * height * 3)
+    else:
+        check_buffer(out, width * height * 3)
+    spheres = array('d')
+    planes = array('d')
+    for obj in objects:
+        if isinstance(obj, Sphere):
+            c = obj.center
+            spheres.extend((c.x, c.y, c.z, obj.radius) + tuple(obj.color))
+        else:
+            p = obj.point
+            n = obj.normal
+            planes.extend((p.x, p.y, p.z, n.x, n.y, n.z) + tuple(obj.color))
+    # cffi refuses empty buffers
+    spheres.append(0.0)
+    planes.append(0.0)
+    lib.render_objects_rgb(ffi.from_buffer(out), width, height, camera.fov,
+                           ffi.from_buffer('double[]', spheres), len(spheres) // 7,
+                           ffi.from_buffer('double[]', planes), len(planes) // 9,
+                           light_dir.x, light_dir.y, light_dir.z, shadows)
+    return out
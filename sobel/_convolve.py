@@ -0,0 +1,145 @@
+"""
+Convolution filters running on the compiled engine of sobel_spy/sobel.spy.
+
+lib.convolve takes any odd-sized integer kernel, with an unrolled loop for
+the 3x3 ones; lib.convolve_separable runs two 1D passes for the kernels which
+lib.separate splits into the outer product of two vectors (box, Gaussian,
+Scharr, ...); lib.convolve_f64 takes a float kernel. This module keeps a few
+common kernels, and wraps the calls for numpy frames, picking the fastest
+path once per kernel:
+
+    blur = Convolution(*KERNELS['gaussian5'])
+    blur(frame, output)
+
+Run this file to compare the FPS of each kernel with the one of sobel:
+
+    python _convolve.py
+"""
+
+import time
+import numpy as np
+from _sobel_spy import ffi, lib
+
+# what the kernel sees outside of the frame, see sobel.spy
+BORDER_SKIP = 0     # the pixels too close to the edge are not written
+BORDER_ZERO = 1
+BORDER_CLAMP = 2
+BORDER_MIRROR = 3
+
+# name -> (kernel, divisor, offset)
+KERNELS = {
+    'box3': (np.ones((3, 3), dtype=np.int32), 9, 0),
+    'box5': (np.ones((5, 5), dtype=np.int32), 25, 0),
+    'gaussian3': (np.outer([1, 2, 1], [1, 2, 1]), 16, 0),
+    'gaussian5': (np.outer([1, 4, 6, 4, 1], [1, 4, 6, 4, 1]), 256, 0),
+    'sharpen': (np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]]), 1, 0),
+    # edges: 128 is no change
+    'laplacian': (np.array([[0, 1, 0], [1, -4, 1], [0, 1, 0]]), 1, 128),
+    'scharr_x': (np.array([[-3, 0, 3], [-10, 0, 10], [-3, 0, 3]]), 16, 128),
+    'scharr_y': (np.array([[-3, -10, -3], [0, 0, 0], [3, 10, 3]]), 16, 128),
+    'emboss': (np.array([[-2, -1, 0], [-1, 1, 1], [0, 1, 2]]), 1, 128),
+}
+
+
+class Convolution:
+    """
+    Convolve frames with a fixed kernel: a square 2D array of odd size, of
+    integers or floats. Each output value is sum / divisor + offset, rounded
+    and clamped to [0, 255]. With luma, the luminance is filtered and written
+    to the 3 channels; otherwise R, G and B are filtered independently.
+    The scratch buffers of the filter are allocated once per frame size.
+    """
+
+    def __init__(self, kernel, divisor=1, offset=0, border: int = BORDER_CLAMP,
+                 luma: bool = False):
+        kernel = np.asarray(kernel)
+        size = len(kernel)
+        if kernel.shape != (size, size) or size % 2 == 0:
+            raise ValueError(f'the kernel must be square, of odd size: {kernel.shape}')
+        if divisor == 0:
+            raise ValueError('the divisor must not be 0')
+        self.size = size
+        self.border = border
+        self.luma = luma
+        self.is_float = (kernel.dtype.kind == 'f' or
+                         not float(divisor).is_integer() or divisor < 0 or
+                         not float(offset).is_integer())
+        # the kernel is copied, and must stay alive as long as self
+        if self.is_float:
+            self.kernel = ffi.new('double[]', [float(k) for k in kernel.flat])
+            self.scale = 1.0 / divisor
+            self.offset = float(offset)
+        else:
+            self.kernel = ffi.new('int32_t[]', [int(k) for k in kernel.flat])
+            self.divisor = int(divisor)
+            self.offset = int(offset)
+            self.kx = ffi.new('int32_t[]', size)
+            self.ky = ffi.new('int32_t[]', size)
+            # the sum with ky[a] * kx[b] is pivot times the one with the kernel
+            pivot = lib.separate(self.kernel, size, self.kx, self.ky)
+            self.separable = pivot > 0
+            if self.separable:
+                self.divisor *= pivot
+        self.scratch = {}  # (h, w) -> (plane, tmp)
+
+    def __call__(self, frame: np.ndarray, output: np.ndarray) -> np.ndarray:
+        h, w, d = frame.shape
+        rgba = d == 4
+        ptr_frame = ffi.from_buffer('uint8_t[]', frame)
+        ptr_output = ffi.from_buffer('uint8_t[]', output)
+        if (h, w) not in self.scratch:
+            n = lib.convolve_scratch_size(h, w, self.size, self.border)
+            self.scratch[h, w] = (ffi.new('uint8_t[]', n), ffi.new('int32_t[]', n))
+        plane, tmp = self.scratch[h, w]
+        if self.is_float:
+            lib.convolve_f64(ptr_frame, h, w, ptr_output, rgba, self.kernel, self.size,
+                             self.scale, self.offset, self.border, self.luma, plane)
+        elif self.separable:
+            lib.convolve_separable(ptr_frame, h, w, ptr_output, rgba, self.kx, self.ky,
+                                   self.size, self.divisor, self.offset, self.border,
+                                   self.luma, plane, tmp)
+        else:
+            lib.convolve(ptr_frame, h, w, ptr_output, rgba, self.kernel, self.size,
+                         self.divisor, self.offset, self.border, self.luma, plane)
+        return output
+
+
+def convolve(frame: np.ndarray, output: np.ndarray, kernel, divisor=1, offset=0,
+             border: int = BORDER_CLAMP, luma: bool = False) -> np.ndarray:
+    return Convolution(kernel, divisor, offset, border, luma)(frame, output)
+
+
+def make_filter(name: str, border: int = BORDER_CLAMP, luma: bool = False) -> Convolution:
+    """The convolution with KERNELS[name]"""
+    kernel, divisor, offset = KERNELS[name]
+    return Convolution(kernel, divisor, offset, border, luma)
+
+
+def benchmark(num_frames: int = 50) -> None:
+    """FPS of sobel and of each kernel of KERNELS, at 720p and 1080p"""
+    rng = np.random.default_rng(0)
+    for width, height in [(1280, 720), (1920, 1080)]:
+        frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        output = np.zeros_like(frame)
+        ptr_frame = ffi.from_buffer('uint8_t[]', frame)
+        ptr_output = ffi.from_buffer('uint8_t[]', output)
+        scratch = ffi.new('uint8_t[]', lib.sobel_scratch_size(height, width, 16, 0))
+
+        filters = [('sobel', lambda: lib.sobel_tiled(ptr_frame, height, width, ptr_output,
+                                                     False, 16, 0, scratch))]
+        for name in KERNELS:
+            conv = make_filter(name)
+            filters.append((name, lambda conv=conv: conv(frame, output)))
+
+        print(f'{width}x{height}:')
+        for name, func in filters:
+            func()  # warm up
+            start = time.perf_counter()
+            for i in range(num_frames):
+                func()
+            fps = num_frames / (time.perf_counter() - start)
+            print(f'    {name:10s}: {fps:7.1f} FPS')
+
+
+if __name__ == '__main__':
+    benchmark()
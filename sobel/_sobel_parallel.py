@@ -0,0 +1,128 @@
+"""
+Run the compiled sobel filter on several threads.
+
+The frame is split into horizontal bands, and each thread calls
+_sobel_spy.lib.sobel_tiled on its own band, with its own scratch plane.
+cffi releases the GIL during the call, so the bands really run in parallel.
+Each band is passed to the filter with one extra (halo) row above and below
+it: the filter only writes the rows which have a neighbor on both sides, so
+every thread writes exactly the rows of its band, and the result is
+identical to a single call on the whole frame.
+
+Run this file to measure how the FPS scale with the number of workers:
+
+    python _sobel_parallel.py
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from _sobel_spy import ffi, lib
+
+
+def bands(height: int, n: int) -> list:
+    """
+    Split the rows which the filter writes, [1, height - 1), into n bands of
+    (almost) the same size. Return a list of (start, stop) ranges.
+    """
+    rows = height - 2
+    n = max(1, min(n, rows))
+    edges = [1 + rows * i // n for i in range(n + 1)]
+    return [(start, stop) for start, stop in zip(edges, edges[1:]) if stop > start]
+
+
+class ParallelSobel:
+    """
+    A persistent pool of `workers` threads running _sobel_spy.lib.sobel_tiled
+    on row bands of the frame. The scratch planes of the bands are allocated
+    once per frame size.
+    """
+
+    def __init__(self, workers: int = None):
+        self.workers = workers or os.cpu_count() or 1
+        # the calling thread processes one of the bands itself
+        self.pool = ThreadPoolExecutor(max_workers=max(1, self.workers - 1))
+        self.scratch = {}  # (h, w) -> one scratch plane per band
+
+    def sobel(self, frame: np.ndarray, output: np.ndarray) -> None:
+        h, w, d = frame.shape
+        rgba = d == 4
+        ptr_frame = ffi.from_buffer('uint8_t[]', frame)
+        ptr_output = ffi.from_buffer('uint8_t[]', output)
+        row_size = w * d
+
+        todo = bands(h, self.workers)
+        if not todo:
+            return
+        if (h, w) not in self.scratch:
+            self.scratch[h, w] = [
+                ffi.new('uint8_t[]', lib.sobel_scratch_size(stop - start + 2, w, 16, 0))
+                for start, stop in todo]
+        scratch = self.scratch[h, w]
+
+        def run(start, stop, plane):
+            # the band plus one halo row on each side
+            offset = (start - 1) * row_size
+            lib.sobel_tiled(ptr_frame + offset, stop - start + 2, w, ptr_output + offset,
+                            rgba, 16, 0, plane)
+
+        futures = [self.pool.submit(run, start, stop, plane)
+                   for (start, stop), plane in zip(todo[1:], scratch[1:])]
+        run(*todo[0], scratch[0])
+        for future in futures:
+            future.result()
+
+    def close(self) -> None:
+        self.pool.shutdown()
+
+
+_default = None
+
+
+def default_sobel() -> ParallelSobel:
+    """A ParallelSobel with one worker per core, created on first use"""
+    global _default
+    if _default is None:
+        _default = ParallelSobel()
+    return _default
+
+
+def sobel(frame: np.ndarray, output: np.ndarray) -> None:
+    default_sobel().sobel(frame, output)
+
+
+def benchmark(num_frames: int = 100) -> None:
+    """FPS at 720p and 1080p, for 1, 2, 4, ... workers up to the number of cores"""
+    cores = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 < cores:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cores:
+        counts.append(cores)
+
+    rng = np.random.default_rng(0)
+    for width, height in [(1280, 720), (1920, 1080)]:
+        frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        expected = np.zeros_like(frame)
+        lib.sobel(ffi.from_buffer('uint8_t[]', frame), height, width,
+                  ffi.from_buffer('uint8_t[]', expected), False)
+
+        print(f'{width}x{height}:')
+        base_fps = None
+        for workers in counts:
+            parallel = ParallelSobel(workers)
+            output = np.zeros_like(frame)
+            parallel.sobel(frame, output)
+            assert (output == expected).all(), 'the bands give a different result'
+            start = time.perf_counter()
+            for i in range(num_frames):
+                parallel.sobel(frame, output)
+            fps = num_frames / (time.perf_counter() - start)
+            parallel.close()
+            base_fps = base_fps or fps
+            print(f'    {workers:2d} workers: {fps:7.1f} FPS, speedup {fps / base_fps:.2f}x')
+
+
+if __name__ == '__main__':
+    benchmark()
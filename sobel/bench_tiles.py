@@ -0,0 +1,68 @@
+"""
+Sweep the tile sizes of the compiled filters (sobel_tiled and blur_tiled in
+sobel_spy/sobel.spy), for frame sizes up to 4K.
+
+For each frame size and tile size, print the time per frame and the memory
+bandwidth it implies (one read of the frame plus one write of the output):
+at large resolutions the filters are limited by the bandwidth, so the best
+tiles are the ones which read each byte from memory only once.
+"""
+
+import argparse
+import time
+import numpy as np
+from _sobel_spy import ffi, lib
+
+FRAME_SIZES = [(640, 480), (1280, 720), (1920, 1080), (3840, 2160)]
+
+# (tile_h, tile_w); 0 means the whole height or width
+TILE_SIZES = [(0, 0), (4, 0), (16, 0), (64, 0), (16, 256), (32, 512), (64, 64)]
+
+
+def run(name, width, height, tile, num_frames):
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    output = np.zeros_like(frame)
+    ptr_frame = ffi.from_buffer('uint8_t[]', frame)
+    ptr_output = ffi.from_buffer('uint8_t[]', output)
+    tile_h, tile_w = tile
+    args = (ptr_frame, height, width, ptr_output, False, tile_h, tile_w)
+    if name == 'sobel':
+        # the scratch plane is allocated once, as a real caller would do
+        size = lib.sobel_scratch_size(height, width, tile_h, tile_w)
+        args += (ffi.new('uint8_t[]', size),)
+    func = getattr(lib, name + '_tiled')
+
+    func(*args)  # warm up
+    start = time.perf_counter()
+    for i in range(num_frames):
+        func(*args)
+    elapsed = (time.perf_counter() - start) / num_frames
+    return elapsed, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--filter', choices=['sobel', 'blur'], default='sobel')
+    parser.add_argument('--frames', type=int, default=20,
+                        help='frames per measurement')
+    args = parser.parse_args()
+
+    for width, height in FRAME_SIZES:
+        print(f'{args.filter} {width}x{height}:')
+        expected = None
+        for tile in TILE_SIZES:
+            elapsed, output = run(args.filter, width, height, tile, args.frames)
+            # every tiling must give the same result
+            if expected is None:
+                expected = output
+            assert (output == expected).all(), f'tile {tile} gives a different result'
+            bandwidth = 2 * width * height * 3 / elapsed / 1e9
+            tile_h = tile[0] or 'h'
+            tile_w = tile[1] or 'w'
+            print(f'    tile {tile_h:>3}x{tile_w:<4}: {elapsed * 1000:7.2f} ms, '
+                  f'{1 / elapsed:7.1f} FPS, {bandwidth:5.2f} GB/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -8,16 +8,31 @@ from collections import deque
 
 #from _sobel_cython import sobel
 #from _sobel_python import sobel
-
-import _sobel_spy
-def sobel(frame, output):
-    h, w, d = frame.shape
-    assert d == 3
-    ptr_frame = _sobel_spy.ffi.from_buffer(frame)
-    ptr_output = _sobel_spy.ffi.from_buffer(output)
-    rgba = False
-    _sobel_spy.lib.sobel(ptr_frame, h, w, ptr_output, rgba)
-    #_sobel_spy.lib.blur(ptr_frame, h, w, ptr_output, rgba)
+#from _sobel_numpy import sobel
+
+try:
+    import _sobel_spy
+except ImportError:
+    # _sobel_spy is not built (see sobel_spy/README.md): use numpy
+    print('_sobel_spy not found, using _sobel_numpy')
+    from _sobel_numpy import sobel
+    HAVE_SPY = False
+else:
+    HAVE_SPY = True
+    # the scratch plane of the filter, allocated once per frame size
+    scratch = {}
+
+    def sobel(frame, output):
+        h, w, d = frame.shape
+        assert d == 3
+        ptr_frame = _sobel_spy.ffi.from_buffer(frame)
+        ptr_output = _sobel_spy.ffi.from_buffer(output)
+        rgba = False
+        if (h, w) not in scratch:
+            size = _sobel_spy.lib.sobel_scratch_size(h, w, 16, 0)
+            scratch[h, w] = _sobel_spy.ffi.new('uint8_t[]', size)
+        _sobel_spy.lib.sobel_tiled(ptr_frame, h, w, ptr_output, rgba, 16, 0, scratch[h, w])
+        #_sobel_spy.lib.blur(ptr_frame, h, w, ptr_output, rgba)
 
 
 def read_frames(source):
@@ -99,5 +114,34 @@ if __name__ == "__main__":
         default='0',
         help="Video source (0 for webcam, or path to video file)"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of threads running the compiled filter on bands of "
+             "rows (0: one per core), see _sobel_parallel.py"
+    )
+    parser.add_argument(
+        "--filter",
+        default="sobel",
+        help="sobel, or the name of a kernel of _convolve.KERNELS (box3, "
+             "gaussian5, sharpen, laplacian, ...), run by the compiled "
+             "convolution engine"
+    )
     args = parser.parse_args()
+    if not HAVE_SPY and (args.filter != "sobel" or args.workers != 1):
+        parser.error("--workers/--filter need the compiled _sobel_spy")
+    if args.filter != "sobel" and args.workers != 1:
+        # the bands of _sobel_parallel only work for the 3x3 sobel kernel
+        parser.error("--workers is only supported with --filter sobel")
+    if args.filter != "sobel":
+        from _convolve import KERNELS, make_filter
+        if args.filter not in KERNELS:
+            parser.error(f"unknown filter: {args.filter}")
+        sobel = make_filter(args.filter)
+    elif args.workers != 1:
+        from _sobel_parallel import ParallelSobel
+        parallel = ParallelSobel(args.workers or None)
+        print(f'workers: {parallel.workers}')
+        sobel = parallel.sobel
     read_frames(args.source)
@@ -128,6 +128,8 @@ async def start_camera(ev):
             in_buf = np.zeros((H, W, 4), dtype=np.uint8)
             out_buf = np.zeros((H, W, 4), dtype=np.uint8)
             js_out_buf = Uint8ClampedArray.new(W*H*4)
+            sobel_np_init(H, W)
+            sobel_spy_init(H, W)
 
 
             frame_proxy = create_proxy(process_frame)
@@ -3,11 +3,16 @@ from pyodide.ffi import to_js, create_proxy
 import _sobel_spy
 from _sobel_spy import ffi
 
+# the scratch plane of the filter, allocated by init() for the frame size
+scratch = None
+
 def init(H, W):
-    pass
+    global scratch
+    size = _sobel_spy.lib.sobel_scratch_size(H, W, 16, 0)
+    scratch = ffi.new('uint8_t[]', size)
 
 def sobel_spy(in_buf, height, width, out_buf):
     rgba = True
     ptr_in_buf = ffi.from_buffer(in_buf)
     ptr_out_buf = ffi.from_buffer(out_buf)
-    _sobel_spy.lib.sobel(ptr_in_buf, height, width, ptr_out_buf, rgba)
+    _sobel_spy.lib.sobel_tiled(ptr_in_buf, height, width, ptr_out_buf, rgba, 16, 0, scratch)
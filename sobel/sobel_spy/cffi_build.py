@@ -7,6 +7,23 @@ ffibuilder = FFI()
 ffibuilder.cdef("""
 void sobel(uint8_t *frame, int32_t w, int32_t h, uint8_t *output, bool rgba);
 void blur(uint8_t *frame, int32_t w, int32_t h, uint8_t *output, bool rgba);
+int32_t sobel_scratch_size(int32_t h, int32_t w, int32_t tile_h, int32_t tile_w);
+void sobel_tiled(uint8_t *frame, int32_t h, int32_t w, uint8_t *output, bool rgba,
+                 int32_t tile_h, int32_t tile_w, uint8_t *scratch);
+void blur_tiled(uint8_t *frame, int32_t h, int32_t w, uint8_t *output, bool rgba,
+                int32_t tile_h, int32_t tile_w);
+int32_t separate(int32_t *kernel, int32_t size, int32_t *kx, int32_t *ky);
+int32_t convolve_scratch_size(int32_t h, int32_t w, int32_t size, int32_t border);
+void convolve(uint8_t *frame, int32_t h, int32_t w, uint8_t *output, bool rgba,
+              int32_t *kernel, int32_t size, int32_t divisor, int32_t offset,
+              int32_t border, bool luma, uint8_t *plane);
+void convolve_separable(uint8_t *frame, int32_t h, int32_t w, uint8_t *output, bool rgba,
+                        int32_t *kx, int32_t *ky, int32_t size, int32_t divisor,
+                        int32_t offset, int32_t border, bool luma, uint8_t *plane,
+                        int32_t *tmp);
+void convolve_f64(uint8_t *frame, int32_t h, int32_t w, uint8_t *output, bool rgba,
+                  double *kernel, int32_t size, double scale, double offset,
+                  int32_t border, bool luma, uint8_t *plane);
 """)
 
 src = """
@@ -14,9 +31,34 @@ src = """
 
 #define sobel spy_sobel$sobel
 #define blur spy_sobel$blur
+#define sobel_scratch_size spy_sobel$sobel_scratch_size
+#define sobel_tiled spy_sobel$sobel_tiled
+#define blur_tiled spy_sobel$blur_tiled
+#define separate spy_sobel$separate
+#define convolve_scratch_size spy_sobel$convolve_scratch_size
+#define convolve spy_sobel$convolve
+#define convolve_separable spy_sobel$convolve_separable
+#define convolve_f64 spy_sobel$convolve_f64
 
 void spy_sobel$sobel(uint8_t *frame, int32_t w, int32_t h, uint8_t *output, bool rgba);
 void spy_sobel$blur(uint8_t *frame, int32_t w, int32_t h, uint8_t *output, bool rgba);
+int32_t spy_sobel$sobel_scratch_size(int32_t h, int32_t w, int32_t tile_h, int32_t tile_w);
+void spy_sobel$sobel_tiled(uint8_t *frame, int32_t h, int32_t w, uint8_t *output, bool rgba,
+                           int32_t tile_h, int32_t tile_w, uint8_t *scratch);
+void spy_sobel$blur_tiled(uint8_t *frame, int32_t h, int32_t w, uint8_t *output, bool rgba,
+                          int32_t tile_h, int32_t tile_w);
+int32_t spy_sobel$separate(int32_t *kernel, int32_t size, int32_t *kx, int32_t *ky);
+int32_t spy_sobel$convolve_scratch_size(int32_t h, int32_t w, int32_t size, int32_t border);
+void spy_sobel$convolve(uint8_t *frame, int32_t h, int32_t w, uint8_t *output, bool rgba,
+                        int32_t *kernel, int32_t size, int32_t divisor, int32_t offset,
+                        int32_t border, bool luma, uint8_t *plane);
+void spy_sobel$convolve_separable(uint8_t *frame, int32_t h, int32_t w, uint8_t *output,
+                                  bool rgba, int32_t *kx, int32_t *ky, int32_t size,
+                                  int32_t divisor, int32_t offset, int32_t border, bool luma,
+                                  uint8_t *plane, int32_t *tmp);
+void spy_sobel$convolve_f64(uint8_t *frame, int32_t h, int32_t w, uint8_t *output, bool rgba,
+                            double *kernel, int32_t size, double scale, double offset,
+                            int32_t border, bool luma, uint8_t *plane);
 """
 
 SPY_ROOT = Path(os.environ["SPY_ROOT"]).absolute()